@@ -0,0 +1,87 @@
+"""
+問題メタデータの保持方法ごとのメモリ使用量を比べるベンチマーク
+
+    旧: problems_map (dict) + diff_map (problem-models.json を丸ごと dict)
+    新: ProblemCatalog
+
+    python bench/bench_catalog.py                 # 実データに近い合成データで計測
+    python bench/bench_catalog.py --cache cache   # bot が保存した実ファイルで計測
+
+tracemalloc で「構築後に残っているバイト数」と、参考として構築・検索の時間を出す。
+"""
+import argparse, gc, json, os, random, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DB_PATH", ":memory:")
+
+
+def synthetic(n, seed=0):
+    rng = random.Random(seed)
+    problems, models = [], {}
+    for i in range(n):
+        pid = f"abc{i // 8:03d}_{'abcdefgh'[i % 8]}"
+        problems.append({"id": pid, "contest_id": pid.split("_")[0], "problem_index": pid[-1].upper(),
+                         "name": f"問題 {i}", "title": f"{pid[-1].upper()}. 問題 {i}"})
+        if rng.random() < 0.8:
+            models[pid] = {"slope": rng.random(), "intercept": rng.random(), "variance": rng.random(),
+                           "difficulty": rng.uniform(-1000, 4000), "discrimination": rng.random(),
+                           "irt_loglikelihood": rng.random(), "irt_users": rng.randrange(1, 10000),
+                           "is_experimental": rng.random() < 0.1, "raw_difficulty": rng.uniform(-1000, 4000)}
+    return json.dumps(problems).encode(), json.dumps(models).encode()
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", help="problems.json / models.json があるディレクトリ")
+    parser.add_argument("-n", type=int, default=16000, help="合成データの問題数")
+    args = parser.parse_args()
+
+    import main as bot_main
+    if args.cache:
+        with open(os.path.join(args.cache, "problems.json"), "rb") as f: problems_raw = f.read()
+        with open(os.path.join(args.cache, "models.json"), "rb") as f: models_raw = f.read()
+    else:
+        problems_raw, models_raw = synthetic(args.n)
+
+    def old():
+        problems_map = {x['id']: x['title'] for x in json.loads(problems_raw)}
+        diff_map = json.loads(models_raw)
+        return problems_map, diff_map
+
+    def new():
+        return bot_main.ProblemCatalog().with_titles(json.loads(problems_raw)).with_difficulties(json.loads(models_raw))
+
+    (problems_map, diff_map), old_size, old_time = measure(old)
+    catalog, new_size, new_time = measure(new)
+
+    ids = list(problems_map)
+    started = time.perf_counter()
+    for pid in ids:
+        problems_map.get(pid, pid); diff_map.get(pid, {}).get('difficulty')
+    old_lookup = (time.perf_counter() - started) / len(ids)
+    started = time.perf_counter()
+    for pid in ids:
+        catalog.title(pid, pid); catalog.difficulty(pid)
+    new_lookup = (time.perf_counter() - started) / len(ids)
+
+    print(f"problems: {len(problems_map)}, models: {len(diff_map)}")
+    print(f"{'':<8} {'retained MB':>12} {'build ms':>9} {'lookup ns':>10}")
+    print(f"{'dict':<8} {old_size / 2**20:>12.2f} {old_time * 1000:>9.1f} {old_lookup * 1e9:>10.0f}")
+    print(f"{'catalog':<8} {new_size / 2**20:>12.2f} {new_time * 1000:>9.1f} {new_lookup * 1e9:>10.0f}")
+    print(f"削減: {(old_size - new_size) / 2**20:.2f} MB ({100 * (1 - new_size / old_size):.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+提出取り込み方式 (INGEST_MODE=user / feed) の比較ベンチマーク
+
+ローカルに kenkoooo の API を模したスタブサーバーを立て、
+登録ユーザー数 10 / 100 / 1000 で check_submissions を1周ずつ回して
+1周あたりのリクエスト数・所要時間・通知件数を比べる。
+続けて、ID ごとの問い合わせ間隔の調整 (活発な人は短く・休眠中の人は長く) で
+1時間あたりのリクエスト数が固定周期と比べてどれだけ減るかを出す。
+
+    python bench/bench_ingest.py [--users 10 100 1000] [--active 0.1]
+
+流量制限はスタブ相手では外しているので、実環境 (kenkoooo: 1req/s) での
+所要時間は「リクエスト数 ÷ KENKOOOO_RPS」秒が下限の目安になる。
+"""
+import argparse, asyncio, os, random, sys, time
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# ベンチマーク中は実際のDBを触らない
+os.environ.setdefault("DB_PATH", ":memory:")
+
+
+class StubKenkoooo:
+    """全ユーザーの提出を epoch 順に持ち、/user/submissions と /from/{epoch} を返す"""
+    def __init__(self):
+        self.subs = []
+        self.next_id = 1
+        self.requests = 0
+
+    def add(self, user_id, epoch, result="AC"):
+        self.subs.append({
+            "id": self.next_id, "epoch_second": epoch, "problem_id": "abc001_a",
+            "contest_id": "abc001", "user_id": user_id, "language": "Python (3.11)",
+            "point": 100.0, "length": 100, "result": result, "execution_time": 10,
+        })
+        self.next_id += 1
+
+    async def user_submissions(self, request):
+        self.requests += 1
+        user = request.query["user"]
+        frm = int(request.query["from_second"])
+        return web.json_response([x for x in self.subs if x["user_id"] == user and x["epoch_second"] >= frm][:500])
+
+    async def recent(self, request):
+        self.requests += 1
+        frm = int(request.match_info["from_second"])
+        return web.json_response([x for x in self.subs if x["epoch_second"] >= frm][:1000])
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/atcoder/atcoder-api/v3/user/submissions", self.user_submissions)
+        app.router.add_get("/atcoder/atcoder-api/v3/from/{from_second}", self.recent)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+
+async def run_scenario(main, mode, n_users, active_ratio, seed=0):
+    rng = random.Random(seed)
+    stub = StubKenkoooo()
+    # 登録済みユーザーのほかに、登録されていない大量の提出者がいる状況を作る
+    now = int(time.time())
+    users = [f"user{i}" for i in range(n_users)]
+    for t in range(now - 3600, now - 600, 2):
+        stub.add(f"stranger{rng.randrange(5000)}", t)
+    for u in users:
+        for _ in range(rng.randrange(0, 5)):
+            stub.add(u, now - rng.randrange(700, 3 * 86400))
+    stub.subs.sort(key=lambda x: x["epoch_second"])
+    port = await stub.start()
+
+    main.INGEST_MODE = mode
+    main.KENKOOOO_API = f"http://127.0.0.1:{port}/atcoder/atcoder-api/v3"
+    bot = main.AtCoderBot()
+    bot.create_session()
+    bot.problems = bot.problems.with_titles([{"id": "abc001_a", "title": "A. 積雪深差"}])
+    bot.rate_limiter = main.HostRateLimiter(limits={}, default=(1e9, 10**9))
+    notified = []
+
+    async def send_ac_notification(info, sub):
+        notified.append(sub["id"])
+    bot.send_ac_notification = send_ac_notification
+    for i, u in enumerate(users):
+        bot.registry.add(main.Registration(1, u, i, 1, only_ac=False))
+
+    # 1周目でカーソルを確立させ、その後に新着提出を足して定常状態の1周を測る
+    await bot.check_submissions()
+    for t in range(now - 120, now):
+        stub.add(f"stranger{rng.randrange(5000)}", t)
+    for u in rng.sample(users, max(1, int(n_users * active_ratio))):
+        stub.add(u, now - rng.randrange(1, 120))
+    stub.subs.sort(key=lambda x: x["epoch_second"])
+    notified.clear()
+    stub.requests = 0
+    # 問い合わせ間隔の調整は外し、全員を問い合わせる1周を測る
+    bot.poll_schedule.clear()
+    bot.feed_due = 0.0
+
+    started = time.perf_counter()
+    await bot.check_submissions()
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    await stub.runner.cleanup()
+    return {"mode": mode, "users": n_users, "requests": stub.requests,
+            "new_connections": bot.poll_stats["new_connections"],
+            "elapsed_ms": elapsed * 1000, "notified": len(notified)}
+
+
+async def run_adaptive(main, n_users, ticks, active_users, seed=0):
+    """
+    INGEST_MODE=user で ticks 回 (POLL_TICK_SEC ごと) 回したときのリクエスト数を数える。
+    先頭の active_users 人だけが毎 tick 提出し、残りは数日前に提出したきり。
+    時間は poll_schedule の期限を tick ごとに前へずらして進める。
+    """
+    rng = random.Random(seed)
+    stub = StubKenkoooo()
+    now = int(time.time())
+    users = [f"user{i}" for i in range(n_users)]
+    for u in users:
+        stub.add(u, now - rng.randrange(2 * 86400, 30 * 86400))
+    for u in users[:active_users]:
+        stub.add(u, now - 60)
+    stub.subs.sort(key=lambda x: x["epoch_second"])
+    port = await stub.start()
+
+    main.INGEST_MODE = "user"
+    main.KENKOOOO_API = f"http://127.0.0.1:{port}/atcoder/atcoder-api/v3"
+    bot = main.AtCoderBot()
+    bot.create_session()
+    bot.problems = bot.problems.with_titles([{"id": "abc001_a", "title": "A. 積雪深差"}])
+    bot.rate_limiter = main.HostRateLimiter(limits={}, default=(1e9, 10**9))
+    async def send_ac_notification(info, sub): pass
+    bot.send_ac_notification = send_ac_notification
+    for i, u in enumerate(users):
+        bot.registry.add(main.Registration(1, u, i, 1, only_ac=False, last_epoch=now - 3 * 86400))
+
+    await bot.check_submissions()
+    stub.requests = 0
+    for tick in range(ticks):
+        for u in users[:active_users]:
+            stub.add(u, int(time.time()))
+        for entry in bot.poll_schedule.values():
+            entry[0] -= main.POLL_TICK_SEC
+        await bot.check_submissions()
+    await bot.session.close()
+    await stub.runner.cleanup()
+    fixed = n_users * ticks * main.POLL_TICK_SEC // (main.POLL_INTERVAL_MIN * 60)
+    return stub.requests, fixed
+
+
+async def amain(args):
+    import main
+    rps = main.HOST_RATE_LIMITS["kenkoooo.com"][0]
+    print(f"{'mode':<5} {'users':>6} {'req/cycle':>10} {'stub ms':>9} {'@%.0frps s' % rps:>9} {'notified':>9} {'new conn':>9}")
+    for n in args.users:
+        for mode in ("user", "feed"):
+            r = await run_scenario(main, mode, n, args.active)
+            print(f"{r['mode']:<5} {r['users']:>6} {r['requests']:>10} {r['elapsed_ms']:>9.1f} "
+                  f"{r['requests'] / rps:>9.0f} {r['notified']:>9} {r['new_connections']:>9}")
+
+    # 1時間分の tick で、固定周期 (POLL_INTERVAL_MIN) と問い合わせ間隔の調整ありを比べる
+    ticks = 3600 // main.POLL_TICK_SEC
+    print()
+    print(f"{'users':>6} {'active':>7} {'fixed req/h':>12} {'adaptive req/h':>15}")
+    for n in args.users:
+        active = max(1, int(n * args.active))
+        adaptive, fixed = await run_adaptive(main, n, ticks, active)
+        print(f"{n:>6} {active:>7} {fixed:>12} {adaptive:>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--active", type=float, default=0.1, help="1周の間に提出するユーザーの割合")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""
+HTML 解析のマイクロベンチマーク
+
+    旧: html.parser でページ全体の木を作ってから find する (イベントループ上で実行)
+    新: parse_* (HTML_PARSER + SoupStrainer で必要な部分だけ) を解析用プールで実行
+
+    python bench/bench_parse.py             # 各ページ 50 回ずつ
+    python bench/bench_parse.py -n 200
+
+bench/fixtures/*.html (make_fixtures.py で生成) を使う。
+前半はページごとの 1 回あたりの解析時間、後半は解析を流している間の
+イベントループの遅れ (10ms 間隔の sleep がどれだけ遅れて戻るか) を測る。
+"""
+import argparse, asyncio, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DB_PATH", ":memory:")
+
+from bs4 import BeautifulSoup
+import main as bot_main
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def old_full(page, *args):
+    """変更前と同じくページ全体を html.parser で組み立てる"""
+    soup = BeautifulSoup(page, "html.parser")
+    return len(soup.find_all("tr"))
+
+
+CASES = [
+    ("contests", "contests.html", bot_main.parse_contest_table, ("contest-table-upcoming", True)),
+    ("home", "home.html", bot_main.parse_home_announcements, ()),
+    ("post", "post.html", bot_main.parse_post_details, ()),
+    ("archive", "archive.html", bot_main.parse_contest_table, ()),
+    ("profile", "profile.html", bot_main.parse_profile, ("algo",)),
+]
+
+
+def per_call(func, page, args, n):
+    started = time.perf_counter()
+    for _ in range(n): func(page, *args)
+    return (time.perf_counter() - started) / n
+
+
+async def loop_lag(run_batch):
+    """run_batch を流している間の、10ms sleep の遅れの最大値と p95 (ms)"""
+    lags, done = [], asyncio.Event()
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - started - 0.01) * 1000)
+    task = asyncio.create_task(probe())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await run_batch()
+    elapsed = time.perf_counter() - started
+    done.set(); await task
+    lags.sort()
+    return elapsed, lags[-1], lags[int(len(lags) * 0.95) - 1] if lags else 0.0
+
+
+async def lag_bench(pages, n):
+    loop = asyncio.get_running_loop()
+
+    async def inline():
+        # 変更前: コルーチンの中でそのまま解析する
+        for _ in range(n):
+            for page in pages:
+                old_full(page); await asyncio.sleep(0)
+
+    def pooled(pool):
+        async def run():
+            for _ in range(n):
+                await asyncio.gather(*(loop.run_in_executor(pool, func, page, *args)
+                                       for _, page, func, args in pages_with_funcs))
+        return run
+
+    pages_with_funcs = [(name, load(fname), func, args) for name, fname, func, args in CASES]
+    results = [("inline html.parser", await loop_lag(inline))]
+    with ThreadPoolExecutor(bot_main.PARSE_WORKERS) as pool:
+        results.append(("thread pool", await loop_lag(pooled(pool))))
+    with ProcessPoolExecutor(bot_main.PARSE_WORKERS) as pool:
+        await loop.run_in_executor(pool, old_full, "")  # 起動コストを除く
+        results.append(("process pool", await loop_lag(pooled(pool))))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50, help="ページごとの繰り返し回数")
+    args = parser.parse_args()
+
+    print(f"parser: {bot_main.HTML_PARSER}")
+    print(f"{'page':<9} {'KB':>5} {'old ms':>8} {'new ms':>8} {'speedup':>8}")
+    pages = []
+    for name, fname, func, fargs in CASES:
+        page = load(fname); pages.append(page)
+        old = per_call(old_full, page, (), args.n)
+        new = per_call(func, page, fargs, args.n)
+        print(f"{name:<9} {len(page.encode()) / 1024:>5.0f} {old * 1000:>8.2f} {new * 1000:>8.2f} {old / new:>7.1f}x")
+
+    print()
+    print(f"{'mode':<20} {'total s':>8} {'lag max ms':>11} {'lag p95 ms':>11}")
+    for mode, (elapsed, worst, p95) in asyncio.run(lag_bench(pages, max(1, args.n // 5))):
+        print(f"{mode:<20} {elapsed:>8.2f} {worst:>11.1f} {p95:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
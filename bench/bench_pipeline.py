@@ -0,0 +1,371 @@
+"""
+通知パイプライン全体のオフライン・ベンチマーク
+
+本物の AtCoderBot を、ローカルのスタブ相手に動かして規模ごとの数字を取る (ネットワーク不要)。
+
+    kenkoooo API   … 別プロセスのスタブ (提出はベンチから /_bench/submit で足す)
+    atcoder.jp     … 同じスタブが bench/fixtures/*.html を返す (時刻は実行時に合わせてずらす)
+    Sheets         … 呼び出し回数と行数を数えるだけの偽ワークシート (1回 SHEETS_RTT 秒)
+    Discord 送信   … 受け取った時刻を記録する偽チャンネル (1回 DISCORD_RTT 秒)
+
+    python bench/bench_pipeline.py                                 # N = 10 100 1000 5000
+    python bench/bench_pipeline.py --sizes 10 100 --out result.json
+    python bench/bench_pipeline.py --mode feed
+
+規模ごとに子プロセスを分けて実行する (ピーク RSS を規模ごとに測るため)。
+1規模の流れ:
+  1. N 件の登録と Sheets への全体書き込み
+  2. 全員が期限切れの状態で check_submissions を1周 (full_cycle)
+  3. active の割合のユーザーが提出 → POLL_TICK_SEC 進めて check_submissions、を ticks 回 (steady_cycle)
+  4. まとめ送りと送信キューが空になるまで待ち、提出が見えてから Discord に届くまでの時間 (e2e) を集計
+  5. 予定表の取り込み・告知の一斉配信・/status 相当のプロフィール取得・Sheets の差分書き込み
+結果は JSON で標準出力 (または --out) に出す。流量制限はスタブ相手では外している。
+"""
+import argparse, asyncio, bisect, json, multiprocessing, os, random, re, resource, subprocess, sys, time
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+# ベンチマーク中は実際のDBを触らない
+os.environ.setdefault("DB_PATH", ":memory:")
+
+FIXTURES = os.path.join(HERE, "fixtures")
+# make_fixtures.py の既定の基準時刻。スタブはこれが「今」になるようにページ内の時刻をずらす
+FIXTURE_BASE = datetime.fromisoformat("2026-10-17T12:00:00+09:00")
+DISCORD_RTT = 0.02
+SHEETS_RTT = 0.2
+
+
+# --- 上流のスタブ (別プロセス) ---
+class Upstream:
+    """kenkoooo の提出 API と atcoder.jp の各ページを返す"""
+    def __init__(self):
+        self.pages = {}
+        shift = datetime.now(timezone.utc) - FIXTURE_BASE
+        def move(m):
+            t = datetime.strptime(m.group(2), "%Y-%m-%d %H:%M:%S%z") + shift
+            return m.group(1) + t.astimezone(FIXTURE_BASE.tzinfo).strftime("%Y-%m-%d %H:%M:%S%z") + m.group(3)
+        for name in ("contests", "home", "post", "archive", "profile"):
+            with open(os.path.join(FIXTURES, f"{name}.html"), encoding="utf-8") as f:
+                self.pages[name] = re.sub(r'(<time class="fixtime fixtime-full">)([^<]+)(</time>)', move, f.read())
+        self.history = [{"IsRated": True, "Place": 100 + i, "OldRating": 1500 + i, "NewRating": 1510 + i,
+                         "Performance": 1600, "ContestName": f"AtCoder Beginner Contest {400 + i}",
+                         "ContestScreenName": f"abc{400 + i}.contest.atcoder.jp",
+                         "EndTime": (FIXTURE_BASE - timedelta(days=7 * (20 - i))).isoformat()} for i in range(20)]
+        self.reset()
+
+    def reset(self):
+        self.by_user = {}   # user_id → 提出 (epoch 昇順)
+        self.feed = []      # 全提出 (epoch 昇順)
+        self.next_id = 1
+        self.counts = {}
+
+    def hit(self, kind):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def add(self, user, epoch):
+        sub = {"id": self.next_id, "epoch_second": epoch, "problem_id": "abc001_a", "contest_id": "abc001",
+               "user_id": user, "language": "Python (3.11)", "point": 100.0, "length": 100,
+               "result": "AC", "execution_time": 10}
+        self.next_id += 1
+        self.by_user.setdefault(user, []).append(sub)
+        self.feed.append(sub)
+        return sub
+
+    async def user_submissions(self, request):
+        self.hit("kenkoooo")
+        subs = self.by_user.get(request.query["user"], [])
+        i = bisect.bisect_left(subs, int(request.query["from_second"]), key=lambda x: x["epoch_second"])
+        return web.json_response(subs[i:i + 500])
+
+    async def recent(self, request):
+        self.hit("kenkoooo")
+        i = bisect.bisect_left(self.feed, int(request.match_info["from_second"]), key=lambda x: x["epoch_second"])
+        return web.json_response(self.feed[i:i + 1000])
+
+    def page(self, name):
+        async def handler(request):
+            self.hit("atcoder")
+            return web.Response(text=self.pages[name], content_type="text/html")
+        return handler
+
+    async def user_history(self, request):
+        self.hit("atcoder")
+        return web.json_response(self.history)
+
+    async def submit(self, request):
+        """{"users": [...], "epoch": 省略可} の提出を足し、[{"id", "visible_at"}] を返す"""
+        body = await request.json()
+        epoch = body.get("epoch") or int(time.time())
+        subs = [self.add(u, epoch) for u in body["users"]]
+        return web.json_response([{"id": s["id"], "visible_at": time.time()} for s in subs])
+
+    async def stats(self, request):
+        return web.json_response(self.counts)
+
+    async def do_reset(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application(client_max_size=64 << 20)
+        r = app.router
+        r.add_get("/atcoder/atcoder-api/v3/user/submissions", self.user_submissions)
+        r.add_get("/atcoder/atcoder-api/v3/from/{from_second}", self.recent)
+        r.add_get("/contests/", self.page("contests"))
+        r.add_get("/contests/archive", self.page("archive"))
+        r.add_get("/home", self.page("home"))
+        r.add_get("/posts/{post_id}", self.page("post"))
+        r.add_get("/users/{user_id}/history/json", self.user_history)
+        r.add_get("/users/{user_id}", self.page("profile"))
+        r.add_post("/_bench/submit", self.submit)
+        r.add_get("/_bench/stats", self.stats)
+        r.add_post("/_bench/reset", self.do_reset)
+        return app
+
+
+def serve_upstream(conn):
+    async def run():
+        runner = web.AppRunner(Upstream().app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        conn.send(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+    asyncio.run(run())
+
+
+# --- Discord / Sheets の偽物 ---
+class FakeMessage:
+    async def edit(self, **kwargs): await asyncio.sleep(DISCORD_RTT)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, sink):
+        self.id, self.sink = channel_id, sink
+
+    async def send(self, content=None, embed=None, embeds=None):
+        await asyncio.sleep(DISCORD_RTT)
+        self.sink.record(self.id, embeds or ([embed] if embed else []))
+        return FakeMessage()
+
+
+class DiscordSink:
+    """届いたメッセージを数え、提出通知は提出 ID ごとに届いた時刻を残す"""
+    def __init__(self):
+        self.messages = 0
+        self.delivered = {}  # 提出 ID → 届いた時刻 (time.time)
+        self.channels = {}
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels: self.channels[channel_id] = FakeChannel(channel_id, self)
+        return self.channels[channel_id]
+
+    def record(self, channel_id, embeds):
+        self.messages += 1
+        now = time.time()
+        for e in embeds:
+            m = re.search(r"/submissions/(\d+)\)", e.description or "")
+            if m: self.delivered.setdefault(int(m.group(1)), now)
+
+
+class FakeWorksheet:
+    def __init__(self):
+        self.calls, self.rows = 0, 0
+
+    def _call(self, rows=0):
+        time.sleep(SHEETS_RTT)
+        self.calls += 1
+        self.rows += rows
+
+    def clear(self): self._call()
+    def update(self, values, range_name=None): self._call(len(values))
+    def batch_update(self, data): self._call(len(data))
+    def append_rows(self, rows): self._call(len(rows))
+    def get_all_records(self): return []
+
+
+class FakeSpreadsheet:
+    def __init__(self): self.ws = FakeWorksheet()
+    def worksheet(self, name): return self.ws
+
+
+# --- 1規模分 (子プロセス) ---
+def pct(values, q):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def scenario(n, url, ticks, active_ratio, mode, seed=0):
+    import main
+    rng = random.Random(seed)
+    main.INGEST_MODE = mode
+    main.KENKOOOO_API = f"{url}/atcoder/atcoder-api/v3"
+    bot = main.AtCoderBot()
+    session = bot.create_session()
+    get = session.get
+    session.get = lambda u, **kw: get(u.replace("https://atcoder.jp", url).replace("https://kenkoooo.com", url), **kw)
+    bot.rate_limiter = main.HostRateLimiter(limits={}, default=(1e9, 10**9))
+    bot.problems = bot.problems.with_titles([{"id": "abc001_a", "title": "A. 積雪深差"}])
+    sink = DiscordSink()
+    bot.get_channel = sink.channel
+    bot.get_user = lambda user_id: None
+    bot.sheet = FakeSpreadsheet()
+    # 本番の既定では仕掛けないが、ベンチでは 100ms 以上の占有を数える
+    bot.monitor.slow_sec = 0.1
+    bot.monitor.install()
+    probe = asyncio.create_task(bot.monitor.probe(0.02), name="loop_probe")
+
+    async with aiohttp.ClientSession() as ctl:
+        async def upstream(path, payload=None):
+            req = ctl.post(url + path, json=payload or {}) if path != "/_bench/stats" else ctl.get(url + path)
+            async with req as resp: return await resp.json()
+        async def kenkoooo_requests():
+            return (await upstream("/_bench/stats")).get("kenkoooo", 0)
+
+        await upstream("/_bench/reset")
+        now = int(time.time())
+        users = [f"user{i}" for i in range(n)]
+        # 活発なユーザーはサーバー・チャンネルに散らばるよう、seed で決まる無作為な部分集合にする
+        active = sorted(rng.sample(users, max(1, int(n * active_ratio))), key=lambda u: int(u[4:]))
+        # 活発なユーザーは直前にも提出していて、最初の1周で「活発」と判定される
+        for i in range(0, len(active), 1000):
+            await upstream("/_bench/submit", {"users": active[i:i + 1000], "epoch": now - 60})
+        channels = max(1, n // 10)
+        regs = [main.Registration(i % max(1, n // 20), u, i, 10_000 + i % channels, only_ac=False,
+                                  last_epoch=now - 2 * 86400) for i, u in enumerate(users)]
+        for r in regs: bot.registry.add(r)
+        bot.store.save_registrations(regs)
+        bot.news_config = {g: 20_000 + g for g in range(min(n, 200))}
+
+        result = {"n": n, "mode": mode, "active_users": len(active)}
+        started = time.perf_counter()
+        for r in regs: bot.mark_dirty(r.key)
+        await bot.flush_sheets()
+        result["sheets_initial_sec"] = time.perf_counter() - started
+
+        # 全員が期限切れの1周
+        before = await kenkoooo_requests()
+        await bot.check_submissions()
+        result["full_cycle"] = {"seconds": bot.poll_stats.get("elapsed"),
+                                "requests": await kenkoooo_requests() - before}
+
+        # 定常状態: 活発なユーザーが提出し、1 tick 進めて回す
+        visible, cycles = {}, []
+        for _ in range(ticks):
+            for entry in bot.poll_schedule.values(): entry[0] -= main.POLL_TICK_SEC
+            bot.feed_due -= main.POLL_TICK_SEC
+            for i in range(0, len(active), 1000):
+                for s in await upstream("/_bench/submit", {"users": active[i:i + 1000]}):
+                    visible[s["id"]] = s["visible_at"]
+            before = await kenkoooo_requests()
+            bot.poll_stats = {}
+            await bot.check_submissions()
+            cycles.append({"seconds": bot.poll_stats.get("elapsed", 0.0), "due": bot.poll_stats.get("due", 0),
+                           "requests": await kenkoooo_requests() - before})
+        result["steady_cycle"] = {
+            "seconds_avg": sum(c["seconds"] for c in cycles) / len(cycles) if cycles else None,
+            "seconds_max": max((c["seconds"] for c in cycles), default=None),
+            "requests_avg": sum(c["requests"] for c in cycles) / len(cycles) if cycles else None,
+            "due_avg": sum(c["due"] for c in cycles) / len(cycles) if cycles else None,
+        }
+
+        # まとめ送りと送信キューが空になるまで待つ
+        while bot.ac_batcher.pending or bot.ac_batcher.tasks: await asyncio.sleep(0.05)
+        await bot.outbound.drain(timeout=600)
+        e2e = [(sink.delivered[i] - t) * 1000 for i, t in visible.items() if i in sink.delivered]
+        result["e2e_ms"] = {"count": len(e2e), "expected": len(visible),
+                            "p50": pct(e2e, 0.5), "p95": pct(e2e, 0.95), "max": max(e2e, default=None)}
+
+        # 予定表・告知の一斉配信・/status 相当・Sheets の差分
+        started = time.perf_counter()
+        await bot.contest_calendar_ingester()
+        result["calendar_sec"] = time.perf_counter() - started
+        started = time.perf_counter()
+        await bot.broadcast_contest("Bench Contest", "https://atcoder.jp/contests/bench001",
+                                    datetime.now(main.JST), "100分", "All", "⏰ 本日開催", {}, kind="bench")
+        while bot.background_tasks: await asyncio.sleep(0.01)
+        result["broadcast"] = {"channels": len(bot.news_config), "seconds": time.perf_counter() - started,
+                               "spread_sec": bot.broadcast_stats.get("spread_sec")}
+        started = time.perf_counter()
+        await asyncio.gather(*(bot.fetch_user_data(bot.session, u) for u in users[:20]))
+        result["status_20_sec"] = time.perf_counter() - started
+        await bot.flush_sheets()
+        result["sheets"] = dict(bot.sheet_stats, calls=bot.sheet.ws.calls)
+
+        probe.cancel()
+        lag = bot.monitor.lag
+        result["loop_lag_ms"] = {"max": lag["max"] * 1000,
+                                 "avg": lag["sum"] / lag["count"] * 1000 if lag["count"] else None}
+        result["slow_callbacks"] = sum(bot.monitor.slow_counts.values())
+        result["discord_messages"] = sink.messages
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    await bot.session.close()
+    bot.parse_pool.shutdown(wait=False)
+    return result
+
+
+def run_one(args):
+    result = asyncio.run(scenario(args.one, args.upstream, args.ticks, args.active, args.mode, args.seed))
+    # 子プロセスの最後の行が結果 (bot のログより後に出す)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def run_all(args):
+    import main
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve_upstream, args=(child,), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{parent.recv()}"
+    results = []
+    try:
+        for n in args.sizes:
+            cmd = [sys.executable, os.path.abspath(__file__), "--one", str(n), "--upstream", url,
+                   "--ticks", str(args.ticks), "--active", str(args.active), "--mode", args.mode,
+                   "--seed", str(args.seed)]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            lines = proc.stdout.strip().splitlines()
+            if proc.returncode != 0 or not lines:
+                results.append({"n": n, "error": proc.stderr.strip().splitlines()[-1:] or ["no output"]})
+            else:
+                results.append(json.loads(lines[-1]))
+            r = results[-1]
+            if "error" in r:
+                print(f"N={n}: 失敗 {r['error']}", file=sys.stderr)
+            else:
+                print(f"N={n}: full {r['full_cycle']['seconds']:.2f}s/{r['full_cycle']['requests']}req, "
+                      f"steady {r['steady_cycle']['seconds_avg']:.2f}s/{r['steady_cycle']['requests_avg']:.0f}req, "
+                      f"e2e p95 {r['e2e_ms']['p95'] or 0:.0f}ms, lag max {r['loop_lag_ms']['max']:.0f}ms, "
+                      f"RSS {r['peak_rss_mb']:.0f}MB", file=sys.stderr)
+    finally:
+        server.terminate()
+    report = {
+        "meta": {"at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                 "html_parser": main.HTML_PARSER, "parse_executor": main.PARSE_EXECUTOR, "mode": args.mode,
+                 "ticks": args.ticks, "active": args.active, "seed": args.seed, "poll_tick_sec": main.POLL_TICK_SEC,
+                 "discord_rtt": DISCORD_RTT, "sheets_rtt": SHEETS_RTT},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--ticks", type=int, default=3, help="定常状態で回す周回数")
+    parser.add_argument("--active", type=float, default=0.1, help="毎周提出するユーザーの割合")
+    parser.add_argument("--mode", choices=["user", "feed"], default=os.getenv("INGEST_MODE", "user"))
+    parser.add_argument("--seed", type=int, default=0, help="活発なユーザーの選び方")
+    parser.add_argument("--out", help="結果の JSON を書き出すファイル (省略時は標準出力)")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.one is not None: run_one(args)
+    else: run_all(args)
@@ -0,0 +1,111 @@
+"""
+bench/fixtures/*.html を作り直すスクリプト
+
+atcoder.jp の各ページ (コンテスト一覧・ホーム・プロフィール・告知・過去コンテスト) と
+同じ構造のページを生成する。ヘッダー・ナビ・インラインスクリプト等も入れて、
+実ページと同程度の大きさにしてある。開始時刻は基準時刻 BASE からの相対で決まる。
+
+    python bench/make_fixtures.py [--base 2026-10-17T12:00:00+09:00]
+"""
+import argparse, html, os, random
+from datetime import datetime, timedelta
+
+OUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+rng = random.Random(0)
+
+
+def page(title, body):
+    nav = "".join(f'<li><a href="/contests/abc{i}">ABC{i}</a></li>' for i in range(300, 420))
+    script = "".join(f"var v{i} = {{'k': {i}, 'name': 'value{i}', 'arr': [{i}, {i + 1}, {i + 2}]}};\n" for i in range(600))
+    footer = "".join(f'<p class="small">リンク {i} <a href="/posts/{i}">お知らせ {i}</a></p>' for i in range(80))
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title} - AtCoder</title>
+<link rel="stylesheet" href="//img.atcoder.jp/public/css/bootstrap.min.css">
+<script>{script}</script></head>
+<body><div id="modal-contest-start" class="modal fade"></div>
+<nav class="navbar navbar-inverse navbar-fixed-top"><div class="container"><ul class="nav navbar-nav">{nav}</ul></div></nav>
+<div id="main-div" class="float-container"><div id="main-container" class="container">
+{body}
+</div></div><hr><footer class="footer"><div class="container">{footer}</div></footer></body></html>"""
+
+
+def contest_row(cid, name, st, dur, rated):
+    return (f'<tr><td class="text-center"><a href="http://www.timeanddate.com/worldclock/fixedtime.html?iso=x" target="blank">'
+            f'<time class="fixtime fixtime-full">{st.strftime("%Y-%m-%d %H:%M:%S%z")}</time></a></td>'
+            f'<td><span aria-hidden="true" data-toggle="tooltip" title="アルゴリズム" class="user-blue">Ⓐ</span> '
+            f'<span class="grey">◉</span> <a href="/contests/{cid}">{name}</a></td>'
+            f'<td class="text-center">{dur}</td><td class="text-center"> {rated}</td></tr>')
+
+
+def table(div_id, rows):
+    head = '<tr><th width="20%">開始時刻</th><th>コンテスト名</th><th width="10%">時間</th><th width="15%">Rated対象</th></tr>'
+    return (f'<div id="{div_id}"><h3>予定されたコンテスト</h3><div class="panel panel-default">'
+            f'<div class="table-responsive"><table class="table table-default table-striped table-hover table-condensed table-bordered small">'
+            f'<thead>{head}</thead><tbody>{"".join(rows)}</tbody></table></div></div></div>')
+
+
+def upcoming(base):
+    rows = []
+    for i in range(12):
+        st = base + timedelta(hours=3 + 20 * i)
+        kind = ["abc", "arc", "ahc", "agc"][i % 4]
+        rows.append(contest_row(f"{kind}{430 + i}", f"AtCoder {'Beginner Regular Heuristic Grand'.split()[i % 4]} Contest {430 + i}",
+                                st, "01:40" if kind != "ahc" else "240:00", ["- 1999", "- 2799", "All", "1200 -"][i % 4]))
+    return rows
+
+
+def recent(base, n):
+    return [contest_row(f"abc{420 - i}", f"AtCoder Beginner Contest {420 - i}", base - timedelta(days=i + 1, hours=2),
+                        "01:40", "- 1999") for i in range(n)]
+
+
+def post_body(cid):
+    writers = ", ".join(f'<a href="https://atcoder.jp/users/writer{i}" class="username"><span class="user-red">writer{i}</span></a>' for i in range(3))
+    testers = ", ".join(f'<a href="https://atcoder.jp/users/tester{i}" class="username"><span class="user-orange">tester{i}</span></a>' for i in range(2))
+    return (f'<p>{cid.upper()} を開催します。</p><ul><li>コンテストページ: <a href="https://atcoder.jp/contests/{cid}">https://atcoder.jp/contests/{cid}</a></li>'
+            f'<li>開始時刻: 2026-10-18(土) 21:00</li><li>コンテスト時間: 100 分</li>'
+            f'<li>Writer: {writers}</li><li>Tester: {testers}</li><li>Rated 対象: ~ 1999</li>'
+            f'<li>配点: 100-200-300-400-475-550-625</li></ul>' + "<p>" + "皆様のご参加をお待ちしております。" * 40 + "</p>")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base", default="2026-10-17T12:00:00+09:00")
+    base = datetime.fromisoformat(parser.parse_args().base)
+    os.makedirs(OUT, exist_ok=True)
+
+    pages = {}
+    pages["contests.html"] = page("コンテスト一覧", table("contest-table-active", recent(base, 3))
+                                  + table("contest-table-permanent", recent(base, 4))
+                                  + table("contest-table-upcoming", upcoming(base))
+                                  + table("contest-table-recent", recent(base, 10)))
+    panels = "".join(
+        f'<div class="panel panel-default"><div class="panel-heading"><h3 class="panel-title">AtCoder Beginner Contest {430 + i} のお知らせ</h3></div>'
+        f'<div class="panel-body blog-post">{post_body(f"abc{430 + i}")}</div></div>' for i in range(10))
+    pages["home.html"] = page("ホーム", f'<div class="row"><div class="col-md-9">{panels}</div><div class="col-md-3">'
+                              + table("contest-table-upcoming", upcoming(base)) + "</div></div>")
+    pages["post.html"] = page("お知らせ", '<div class="panel panel-default"><div class="panel-body blog-post">'
+                              + html.escape(post_body("abc430")) + "</div></div>")
+    pages["archive.html"] = page("過去のコンテスト", '<div class="table-responsive"><table class="table table-default table-striped table-hover table-condensed table-bordered small">'
+                                 '<thead><tr><th>開始時刻</th><th>コンテスト名</th><th>時間</th><th>Rated対象</th></tr></thead><tbody>'
+                                 + "".join(recent(base, 50)) + "</tbody></table></div>")
+    info_rows = "".join(f"<tr><th class=\"no-break\">{k}</th><td>{v}</td></tr>" for k, v in
+                        [("国と地域", "Japan"), ("誕生年", "2000"), ("所属", "AtCoder University")])
+    rating_rows = "".join(f"<tr><th class=\"no-break\">{k}</th><td>{v}</td></tr>" for k, v in
+                          [("順位", "1234th"), ("Rating", '<span class="user-cyan">1500</span>'),
+                           ("最高Rating", '<span class="user-cyan">1555</span> <span class="gray">―</span> <span class="bold">1級</span>'),
+                           ("Rated対象コンテスト参加回数", "88"), ("最後に参加した日", "2026/10/11")])
+    graph = "<script>var rating_history=[" + ",".join(
+        f'{{"EndTime":{1600000000 + i * 604800},"NewRating":{1000 + i},"OldRating":{999 + i},"Place":{rng.randrange(1, 9000)},"ContestName":"ABC{i}","StandingsUrl":"/contests/abc{i}/standings?watching=user"}}'
+        for i in range(300)) + "];</script>"
+    pages["profile.html"] = page("user", f'<div class="row"><div class="col-md-3 col-sm-12"><h3><a class="username" href="/users/user">user</a></h3>'
+                                 f'<table class="dl-table">{info_rows}</table></div><div class="col-md-9 col-sm-12">'
+                                 f'<table class="dl-table mt-2">{rating_rows}</table>{graph}</div></div>')
+    for name, text in pages.items():
+        with open(os.path.join(OUT, name), "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"{name}: {len(text.encode()) // 1024}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+コンテスト通知と提出通知の仮想時刻シミュレーション
+
+AtCoderBot の予定表取り込み・コンテスト通知 (run_contest_notifier)・提出チェックを、
+実時間を待たずに仮想時刻で動かし、各通知が理想の時刻からどれだけ遅れたか、
+取りこぼし・二重送信がないかを調べる。同じ入力なら毎回同じ結果になる。
+
+    python bench/simulate.py                         # 1週間分の合成予定表 + ABC 中の 5000 提出
+    python bench/simulate.py --days 2 --burst 20000 --users 3000
+    python bench/simulate.py --calendar cal.json --submissions subs.jsonl --out report.json
+    python bench/simulate.py --days 1 --outage 21.5 0.5   # ABC 中に kenkoooo が30分落ちる
+
+入力 (省略時は合成):
+  --calendar     予定表のスナップショット列 (JSON)。その時刻以降は最新のスナップショットが見える。
+                 [{"at": ISO時刻, "contests": [{"id", "name", "start": ISO時刻, "duration": "01:40", "rated"}]}]
+  --submissions  kenkoooo 形式の提出を1行1件で並べた JSON Lines。epoch_second + --crawl-lag 秒後に見えるようになる。
+  --outage       開始から何時間後に何時間、--outage-host が 503 を返すか (--outage-retry-after で Retry-After も付ける)。
+
+期間の終わりから NOTICE_GRACE_SEC 秒は集計対象外の猶予として回し続ける。
+仮想時刻の進め方: イベントループが何も実行できなくなったら、次のタイマーの時刻まで時計を飛ばす。
+処理そのものは仮想時間を消費しないので、遅れは待ち時間 (ポーリング間隔・流量制限・まとめ送り・
+Discord の応答時間 --discord-rtt) だけから決まる。HTML 解析は同じスレッドで行う。
+"""
+import argparse, asyncio, bisect, concurrent.futures, contextlib, json, os, random, re, sys
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+# シミュレーション中は実際のDBを触らない
+os.environ.setdefault("DB_PATH", ":memory:")
+
+import main
+from make_fixtures import contest_row, table, page
+
+START = "2026-10-17T00:00:00+09:00"  # 土曜日
+
+
+# --- 仮想時刻 ---
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """実行できるものが無くなったら次のタイマーまで時刻を飛ばすイベントループ"""
+    def __init__(self):
+        super().__init__()
+        self.virtual = 0.0
+        real_select = self._selector.select
+        def select(timeout=None):
+            events = real_select(0)
+            if events or timeout == 0: return events
+            if timeout is None: return real_select(None)
+            self.virtual += timeout
+            return []
+        self._selector.select = select
+
+    def time(self):
+        return self.virtual
+
+
+class VirtualClock(main.Clock):
+    def __init__(self, loop, start):
+        self.loop, self.start = loop, start
+
+    def time(self): return self.start + self.loop.time()
+    def monotonic(self): return self.loop.time()
+
+
+class InlineExecutor(concurrent.futures.Executor):
+    """解析をその場で実行する（別スレッドの完了を待つ間に仮想時刻が飛ばないように）"""
+    def submit(self, fn, *args, **kwargs):
+        fut = concurrent.futures.Future()
+        try: fut.set_result(fn(*args, **kwargs))
+        except Exception as e: fut.set_exception(e)
+        return fut
+
+
+# --- 上流 (atcoder.jp / kenkoooo) の代わり ---
+class FakeResponse:
+    def __init__(self, status, body, headers=None):
+        self.status, self.body, self.headers = status, body, headers or {}
+
+    async def __aenter__(self): return self
+    async def __aexit__(self, *exc): return False
+    async def text(self): return self.body if isinstance(self.body, str) else json.dumps(self.body)
+    async def json(self, **kwargs): return self.body
+
+
+class FakeUpstream:
+    """予定表スナップショットと提出列を仮想時刻に合わせて返す aiohttp.ClientSession の代わり"""
+    def __init__(self, clock, snapshots, subs, crawl_lag, outage=None):
+        self.clock = clock
+        # (ホスト, 落ちている時刻, 戻る時刻, Retry-After) と、落ちている間に受けたリクエスト数
+        self.outage = outage
+        self.failed = {}
+        self.snapshots = sorted(snapshots, key=lambda s: s["at"])
+        self.snapshot_at = [s["at"] for s in self.snapshots]
+        # 見えるようになる時刻の順に並べておく
+        self.subs = sorted(subs, key=lambda x: (x["epoch_second"] + crawl_lag, x["id"]))
+        self.visible_at = [x["epoch_second"] + crawl_lag for x in self.subs]
+        self.by_user = {}
+        for i, x in enumerate(self.subs): self.by_user.setdefault(x["user_id"], []).append(i)
+        with open(os.path.join(HERE, "fixtures", "post.html"), encoding="utf-8") as f:
+            self.post = f.read()
+        self.requests = {}
+
+    def calendar(self, now):
+        i = bisect.bisect_right(self.snapshot_at, now) - 1
+        if i < 0: return []
+        return [c for c in self.snapshots[i]["contests"] if c["start"] > now]
+
+    def visible(self, now):
+        return bisect.bisect_right(self.visible_at, now)
+
+    def get(self, url, **kwargs):
+        now = self.clock.time()
+        parts = urlsplit(url)
+        host = parts.hostname
+        self.requests[host] = self.requests.get(host, 0) + 1
+        if self.outage and host == self.outage[0] and self.outage[1] <= now < self.outage[2]:
+            self.failed[host] = self.failed.get(host, 0) + 1
+            retry_after = self.outage[3]
+            return FakeResponse(503, "", {"Retry-After": str(retry_after)} if retry_after is not None else None)
+        if host == "atcoder.jp" and parts.path == "/contests/":
+            rows = [contest_row(c["id"], c["name"], datetime.fromtimestamp(c["start"], main.JST), c["duration"], c["rated"])
+                    for c in self.calendar(now)]
+            return FakeResponse(200, page("コンテスト一覧", table("contest-table-upcoming", rows)))
+        if host == "atcoder.jp" and parts.path.startswith("/posts/"):
+            return FakeResponse(200, self.post)
+        if parts.path.endswith("/user/submissions"):
+            q = parse_qs(parts.query)
+            n, frm = self.visible(now), int(q["from_second"][0])
+            idx = [i for i in self.by_user.get(q["user"][0], []) if i < n and self.subs[i]["epoch_second"] >= frm]
+            return FakeResponse(200, [self.subs[i] for i in idx][:500])
+        m = re.search(r"/from/(\d+)$", parts.path)
+        if m:
+            frm = int(m.group(1))
+            found = sorted((x for x in self.subs[:self.visible(now)] if x["epoch_second"] >= frm),
+                           key=lambda x: x["epoch_second"])
+            return FakeResponse(200, found[:1000])
+        return FakeResponse(404, "")
+
+    async def close(self): pass
+
+
+# --- Discord の代わり ---
+class FakeMessage:
+    async def edit(self, **kwargs): pass
+
+
+class FakeChannel:
+    def __init__(self, channel_id, sink):
+        self.id, self.sink = channel_id, sink
+
+    async def send(self, content=None, embed=None, embeds=None):
+        await asyncio.sleep(self.sink.rtt)
+        self.sink.record(self.id, content, embeds or ([embed] if embed else []))
+        return FakeMessage()
+
+
+class Sink:
+    """届いたメッセージを仮想時刻つきで記録する"""
+    LABELS = {label: kind for kind, _, _, label in main.CONTEST_NOTICES}
+
+    def __init__(self, clock, rtt):
+        self.clock, self.rtt = clock, rtt
+        self.channels = {}
+        self.notices = []      # (contest_id, kind, channel_id, 時刻)
+        self.submissions = []  # (submission_id, channel_id, 時刻)
+
+    def channel(self, channel_id):
+        if channel_id not in self.channels: self.channels[channel_id] = FakeChannel(channel_id, self)
+        return self.channels[channel_id]
+
+    def record(self, channel_id, content, embeds):
+        now = self.clock.time()
+        label = (content or "").strip("*")
+        for e in embeds:
+            m = re.search(r"/submissions/(\d+)\)", e.description or "")
+            if m:
+                self.submissions.append((int(m.group(1)), channel_id, now))
+            elif label in self.LABELS and e.url:
+                self.notices.append((e.url.rstrip("/").split("/")[-1], self.LABELS[label], channel_id, now))
+
+
+# --- 合成データ ---
+def synthetic_calendar(start, days):
+    """毎週の ABC (土) / ARC (日) / AHC (水) と、途中で1時間後ろにずれる ARC を含む予定表"""
+    base = datetime.fromtimestamp(start, main.JST).replace(hour=0, minute=0, second=0)
+    contests, n = [], 0
+    for d in range(int(days) + 2):
+        day = base + timedelta(days=d)
+        for weekday, kind, hour, dur, rated, name in [(5, "abc", 21, "01:40", "- 1999", "Beginner"),
+                                                      (6, "arc", 21, "02:00", "1200 - 2799", "Regular"),
+                                                      (2, "ahc", 19, "04:00", "All", "Heuristic")]:
+            if day.weekday() != weekday: continue
+            n += 1
+            contests.append({"id": f"{kind}{500 + n}", "name": f"AtCoder {name} Contest {500 + n}",
+                             "start": (day + timedelta(hours=hour)).timestamp(), "duration": dur, "rated": rated})
+    snapshots = [{"at": start - 86400, "contests": contests}]
+    arc = next((c for c in contests if c["id"].startswith("arc")), None)
+    if arc:
+        # 開始の30時間前 (24h 通知の前) に1時間延期される
+        moved = [dict(c, start=c["start"] + 3600) if c is arc else c for c in contests]
+        snapshots.append({"at": arc["start"] - 30 * 3600, "contests": moved})
+    return snapshots
+
+
+def synthetic_submissions(snapshots, users, burst, seed):
+    """最初の ABC の開催中に burst 件 (AC は約4割) と、ふだんの少量の提出"""
+    rng = random.Random(seed)
+    contests = snapshots[-1]["contests"]
+    abc = next(c for c in contests if c["id"].startswith("abc"))
+    minutes = main.AtCoderBot.parse_duration(None, abc["duration"])
+    subs = []
+    def add(user, epoch, contest_id):
+        subs.append({"id": 0, "epoch_second": int(epoch), "problem_id": f"{contest_id}_{rng.choice('abcdefg')}",
+                     "contest_id": contest_id, "user_id": user, "language": "Python (CPython 3.11.4)", "point": 100.0,
+                     "length": 300, "result": "AC" if rng.random() < 0.4 else rng.choice(["WA", "TLE", "RE"]),
+                     "execution_time": rng.randrange(1, 2000)})
+    for _ in range(burst):
+        # 開始直後に多く、終盤は少なめ
+        add(f"user{rng.randrange(users)}", abc["start"] + minutes * 60 * rng.random() ** 1.5, abc["id"])
+    first = snapshots[0]["at"] + 86400
+    for _ in range(users // 5):
+        add(f"user{rng.randrange(users)}", first + rng.random() * (abc["start"] - first), "abc400")
+    # kenkoooo と同じく提出 ID は時刻順に振る
+    subs.sort(key=lambda x: x["epoch_second"])
+    for i, x in enumerate(subs): x["id"] = i + 1
+    return subs
+
+
+def load_calendar(path):
+    with open(path, encoding="utf-8") as f: snapshots = json.load(f)
+    ts = lambda v: datetime.fromisoformat(v).timestamp() if isinstance(v, str) else v
+    return [{"at": ts(s["at"]), "contests": [dict(c, start=ts(c["start"])) for c in s["contests"]]} for s in snapshots]
+
+
+def load_submissions(path):
+    with open(path, encoding="utf-8") as f: return [json.loads(line) for line in f if line.strip()]
+
+
+# --- 集計 ---
+def pct(values, q):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(delays):
+    return {"count": len(delays), "p50": pct(delays, 0.5), "p95": pct(delays, 0.95), "max": max(delays, default=None)}
+
+
+def expected_notices(snapshots, start, end):
+    """各通知の理想時刻。その時刻に見えている予定表の内容を正とする"""
+    out = {}
+    for s_i, snap in enumerate(snapshots):
+        valid_until = snapshots[s_i + 1]["at"] if s_i + 1 < len(snapshots) else float("inf")
+        for c in snap["contests"]:
+            st = datetime.fromtimestamp(c["start"], main.JST)
+            en = st + timedelta(minutes=main.AtCoderBot.parse_duration(None, c["duration"]))
+            for kind, anchor, offset, _ in main.CONTEST_NOTICES:
+                ideal = ((st if anchor == "start" else en) + offset).timestamp()
+                if start < ideal <= end and snap["at"] <= ideal < valid_until:
+                    out[(c["id"], kind)] = ideal
+    return out
+
+
+async def simulate(args, loop):
+    start = datetime.fromisoformat(args.start).timestamp()
+    end = start + args.days * 86400
+    clock = VirtualClock(loop, start)
+    snapshots = load_calendar(args.calendar) if args.calendar else synthetic_calendar(start, args.days)
+    subs = load_submissions(args.submissions) if args.submissions else \
+        synthetic_submissions(snapshots, args.users, args.burst, args.seed)
+
+    # 再試行・遮断器のジッターも含めて毎回同じ結果にする
+    random.seed(args.seed)
+    outage = None
+    if args.outage:
+        down = start + args.outage[0] * 3600
+        outage = (args.outage_host, down, down + args.outage[1] * 3600, args.outage_retry_after)
+    bot = main.AtCoderBot(clock=clock)
+    bot.session = FakeUpstream(clock, snapshots, subs, args.crawl_lag, outage)
+    bot.parse_pool = InlineExecutor()
+    if args.no_rate_limit: bot.rate_limiter = main.HostRateLimiter(limits={}, default=(1e9, 10**9), clock=clock)
+    sink = Sink(clock, args.discord_rtt)
+    bot.get_channel = sink.channel
+    bot.get_user = lambda user_id: None
+    async def ready(): pass
+    bot.wait_until_ready = ready
+    bot.problems = bot.problems.with_titles([{"id": x["problem_id"], "title": x["problem_id"]} for x in subs])
+
+    users = sorted({x["user_id"] for x in subs} | {f"user{i}" for i in range(args.users)})
+    for i, u in enumerate(users):
+        bot.registry.add(main.Registration(i % 50, u, i, 10_000 + i % args.channels, only_ac=True,
+                                           last_epoch=int(start)))
+    bot.news_config = {g: 20_000 + g for g in range(args.news_channels)}
+
+    # tasks.loop は実時刻で次の周回を決めるので、周期の駆動はここで仮想時刻の sleep で行う
+    async def every(interval, name, func):
+        while True:
+            try: await func()
+            except Exception as e: print(f"⚠️ {name}: {e}", file=sys.stderr)
+            await asyncio.sleep(interval)
+
+    tasks = [asyncio.create_task(bot.run_contest_notifier(), name="contest_notifier"),
+             asyncio.create_task(every(main.CALENDAR_REFRESH_MIN * 60, "calendar", bot.contest_calendar_ingester)),
+             asyncio.create_task(every(main.POLL_TICK_SEC, "check_submissions", bot.check_submissions))]
+    # 期間の終わりちょうどの通知も届くよう、猶予の分だけ余分に回してから止める
+    await asyncio.sleep(end - start + main.NOTICE_GRACE_SEC)
+    for t in tasks: t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # 期間の最後に積まれた分は送り切る
+    bot.ac_batcher.flush()
+    await bot.outbound.drain(timeout=3600)
+
+    # コンテスト通知: 理想時刻からの遅れ・取りこぼし・二重送信
+    expected = expected_notices(snapshots, start, end)
+    fired = {}
+    for c_id, kind, channel_id, at in sink.notices:
+        fired.setdefault((c_id, kind), {}).setdefault(channel_id, []).append(at)
+    notices, missed, duplicated = [], [], []
+    for key, ideal in sorted(expected.items(), key=lambda kv: kv[1]):
+        per_channel = fired.get(key, {})
+        if len(per_channel) < len(bot.news_config): missed.append({"contest": key[0], "kind": key[1],
+                                                                    "channels": len(bot.news_config) - len(per_channel)})
+        if not per_channel: continue
+        first = min(min(v) for v in per_channel.values())
+        last = max(min(v) for v in per_channel.values())
+        notices.append({"contest": key[0], "kind": key[1],
+                        "ideal": datetime.fromtimestamp(ideal, main.JST).isoformat(),
+                        "delay_sec": first - ideal, "last_channel_delay_sec": last - ideal})
+    for key, per_channel in fired.items():
+        extra = sum(len(v) - 1 for v in per_channel.values())
+        if extra: duplicated.append({"contest": key[0], "kind": key[1], "extra": extra})
+    unexpected = [{"contest": c, "kind": k} for (c, k) in fired if (c, k) not in expected]
+
+    # 提出通知: 提出時刻から届くまで
+    registered = {r.atcoder_id for r in bot.registry}
+    want = {x["id"]: x["epoch_second"] for x in subs
+            if x["user_id"] in registered and x["result"] == "AC" and start <= x["epoch_second"] <= end - args.crawl_lag}
+    got = {}
+    for sub_id, channel_id, at in sink.submissions:
+        got.setdefault(sub_id, []).append(at)
+    delays = [min(got[i]) - t for i, t in want.items() if i in got]
+
+    return {
+        "meta": {"start": args.start, "days": args.days, "users": len(users), "submissions": len(subs),
+                 "news_channels": args.news_channels, "crawl_lag": args.crawl_lag, "discord_rtt": args.discord_rtt,
+                 "rate_limited": not args.no_rate_limit, "ingest_mode": main.INGEST_MODE,
+                 "poll_tick_sec": main.POLL_TICK_SEC, "seed": args.seed, "outage": args.outage,
+                 "outage_host": args.outage_host if args.outage else None},
+        "contest_notices": {"expected": len(expected), "fired": len(notices), "missed": missed,
+                            "duplicated": duplicated, "unexpected": unexpected,
+                            "delay_sec": summarize([n["delay_sec"] for n in notices]), "fired_list": notices},
+        "submissions": {"expected": len(want), "delivered": len(delays), "missed": len(want) - len(delays),
+                        "duplicated": sum(len(v) - 1 for v in got.values()), "delay_sec": summarize(delays)},
+        "upstream_requests": bot.session.requests,
+        "upstream_failed": bot.session.failed,
+        "breakers": {h: {"trips": b.trips, "rejected": b.rejected, "retries": b.retries, "state": b.state}
+                     for h, b in bot.breakers.by_host.items()},
+        "poll_paused": bot.poll_totals["paused"],
+        "discord": {k: v for k, v in bot.outbound.snapshot().items() if k in ("sent", "failed", "dropped", "retried")},
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", default=START, help="シミュレーション開始時刻 (ISO)")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--calendar", help="予定表スナップショットの JSON")
+    parser.add_argument("--submissions", help="提出の JSON Lines")
+    parser.add_argument("--users", type=int, default=1000, help="登録ユーザー数 (合成時は提出者の数も兼ねる)")
+    parser.add_argument("--burst", type=int, default=5000, help="合成時: ABC 中の提出数")
+    parser.add_argument("--channels", type=int, default=100, help="提出通知を送るチャンネル数")
+    parser.add_argument("--news-channels", type=int, default=50, help="コンテスト告知を送るチャンネル数")
+    parser.add_argument("--crawl-lag", type=int, default=30, help="提出が kenkoooo に現れるまでの秒数")
+    parser.add_argument("--discord-rtt", type=float, default=0.15, help="Discord への1送信にかかる秒数")
+    parser.add_argument("--no-rate-limit", action="store_true", help="kenkoooo / atcoder.jp の流量制限を外す")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--outage", type=float, nargs=2, metavar=("AFTER_H", "HOURS"),
+                        help="開始から AFTER_H 時間後に HOURS 時間、上流を落とす")
+    parser.add_argument("--outage-host", default="kenkoooo.com")
+    parser.add_argument("--outage-retry-after", type=int, help="落ちている間の 503 に付ける Retry-After (秒)")
+    parser.add_argument("--out", help="結果の JSON を書き出すファイル (省略時は標準出力)")
+    parser.add_argument("--verbose", action="store_true", help="bot のログを標準エラーに出す")
+    args = parser.parse_args()
+
+    loop = VirtualTimeLoop()
+    asyncio.set_event_loop(loop)
+    # bot のログは --verbose のときだけ標準エラーに出す（標準出力は結果の JSON 用）
+    log = sys.stderr if args.verbose else open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(log):
+            report = loop.run_until_complete(simulate(args, loop))
+    finally:
+        loop.close()
+    c, s = report["contest_notices"], report["submissions"]
+    print(f"コンテスト通知: {c['fired']}/{c['expected']} 件, 取りこぼし {len(c['missed'])}, 二重 {len(c['duplicated'])}, "
+          f"遅れ p95 {c['delay_sec']['p95'] or 0:.1f}s / 最大 {c['delay_sec']['max'] or 0:.1f}s", file=sys.stderr)
+    print(f"提出通知: {s['delivered']}/{s['expected']} 件, 二重 {s['duplicated']}, "
+          f"遅れ p50 {s['delay_sec']['p50'] or 0:.0f}s / p95 {s['delay_sec']['p95'] or 0:.0f}s / "
+          f"最大 {s['delay_sec']['max'] or 0:.0f}s", file=sys.stderr)
+    if args.outage:
+        print(f"障害: {args.outage_host} 失敗応答 {report['upstream_failed'].get(args.outage_host, 0)} 件, "
+              f"遮断器 {report['breakers'].get(args.outage_host)}, 提出チェック休止 {report['poll_paused']} 回", file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,24 +1,177 @@
 import discord
 from discord import app_commands
 from discord.ext import tasks
-import os, aiohttp, re, gspread
+import os, aiohttp, re, gspread, asyncio, time, sqlite3, json, sys, math, heapq, hashlib, random, contextlib, functools, hmac
+from array import array
+from collections import deque
+import logging, logging.handlers
+from urllib.parse import urlsplit
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta, timezone
-from flask import Flask
-from threading import Thread
-from bs4 import BeautifulSoup
-
-# --- Flask Server ---
-app = Flask('')
-@app.route('/')
-def home(): return "Bot is running!"
-def run(): app.run(host='0.0.0.0', port=8080)
-def keep_alive(): Thread(target=run).start()
+from aiohttp import web
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import html as html_lib
+from email.utils import parsedate_to_datetime
 
 # --- 設定 ---
 JST = timezone(timedelta(hours=9))
 SHEET_NAME = "AtCoderBot_DB"
 
+# 提出チェックの周期 (分) と同時に問い合わせるワーカー数
+POLL_INTERVAL_MIN = 3
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "8"))
+# AtCoder ID ごとの問い合わせ間隔 (秒)。POLL_TICK_SEC ごとに期限が来た ID だけを問い合わせる
+# 新しい提出があれば最短に戻し、無ければ倍々に延ばす (最後の提出からの経過時間 / POLL_IDLE_RATIO も下限にする)
+POLL_TICK_SEC = 60
+POLL_MIN_INTERVAL_SEC = 60
+POLL_MAX_INTERVAL_SEC = 15 * 60
+POLL_IDLE_RATIO = 10
+# コンテスト開催中は全員をこの間隔で問い合わせる
+# 対象は開催時間が POLL_CONTEST_MAX_DURATION 以下のもの (ABC/ARC/AGC・短期 AHC)。長期コンテストは普段どおり
+POLL_CONTEST_INTERVAL_SEC = 60
+POLL_CONTEST_MAX_DURATION = timedelta(hours=5)
+# 問い合わせはこの秒数以内に提出があった ID を先にし、あとは期限を過ぎている順 (登録順だと後ろの ID が毎回待たされる)
+POLL_ACTIVE_SEC = 2 * 3600
+# ホストごとの流量制限 (1秒あたりのリクエスト数, バースト)
+# kenkoooo は「1秒以上間隔を空ける」ことを求めているので既定は 1req/s
+HOST_RATE_LIMITS = {
+    "kenkoooo.com": (float(os.getenv("KENKOOOO_RPS", "1")), 1),
+    "atcoder.jp": (float(os.getenv("ATCODER_RPS", "2")), 2),
+}
+DEFAULT_RATE_LIMIT = (5.0, 5)
+# 提出カーソル (最後に見た epoch_second) から遡る安全マージン (秒)
+# kenkoooo のクロール遅れで後から現れる提出を取りこぼさないため
+CURSOR_OVERLAP_SEC = 300
+
+# 提出の取り込み方式
+#   "user": 登録ユーザーごとに /user/submissions を叩く（従来方式）
+#   "feed": 全ユーザーの新着提出 /from/{epoch} を1本だけ読み、登録ユーザー分を拾う
+INGEST_MODE = os.getenv("INGEST_MODE", "user")
+KENKOOOO_API = os.getenv("KENKOOOO_API", "https://kenkoooo.com/atcoder/atcoder-api/v3")
+# /from/ は1回で最大1000件返すので、それを超えたら続きを読む（1周あたりの上限ページ数）
+FEED_PAGE_SIZE = 1000
+FEED_MAX_PAGES = 20
+# 初回（カーソル未保存）に遡る秒数
+FEED_INITIAL_LOOKBACK = 600
+
+# ローカルDB (SQLite)。こちらが正で、Sheets はバックアップ用のミラー
+DB_PATH = os.getenv("DB_PATH", "atcoder_bot.db")
+
+# コンテスト通知の種類: (種類, 基準時刻, 基準からのずれ, ラベル)
+CONTEST_NOTICES = [
+    ("24h", "start", timedelta(hours=-24), "⏰ 24時間前"),
+    ("15m", "start", timedelta(minutes=-15), "⚠️ 15分前"),
+    ("start", "start", timedelta(0), "🚀 開始！"),
+    ("end", "end", timedelta(0), "🏁 終了！"),
+]
+# 送信済みコンテスト通知の記録を残す期間（長期コンテストの終了通知まで覚えておける長さ）
+SENT_NOTICE_TTL_SEC = 30 * 86400
+# 予定時刻を過ぎていても、この秒数以内なら遅れて送る（それより古いものは見送る）
+NOTICE_GRACE_SEC = int(os.getenv("NOTICE_GRACE_SEC", "300"))
+# コンテスト予定表の確認間隔 (分) と、詳細を取得して予約に入れる範囲
+# 範囲は 24h 前通知に間に合うよう「24時間 + 確認間隔」より少し広くとる
+CALENDAR_REFRESH_MIN = int(os.getenv("CALENDAR_REFRESH_MIN", "10"))
+CALENDAR_HORIZON = timedelta(hours=24, minutes=CALENDAR_REFRESH_MIN + 5)
+
+# 提出通知は チャンネルごとにまとめて1メッセージ (最大10 Embed) で送る
+# 最後の通知から AC_BATCH_WINDOW_SEC 秒新しいものが来なければ送信、
+# どんなに続いても最初の通知から AC_BATCH_MAX_DELAY_SEC 秒以内には送る
+AC_BATCH_WINDOW_SEC = float(os.getenv("AC_BATCH_WINDOW_SEC", "2"))
+AC_BATCH_MAX_DELAY_SEC = float(os.getenv("AC_BATCH_MAX_DELAY_SEC", "10"))
+MAX_EMBEDS_PER_MESSAGE = 10
+
+# Discord への送信キュー: 優先度 (小さいほど先), 再試行, 同時送信数, チャンネルごとの上限
+PRIORITY_CONTEST = 0   # コンテスト告知 (開始・終了など)
+PRIORITY_COMMAND = 1   # コマンドへの応答・状況表示
+PRIORITY_AC = 2        # 提出通知
+SEND_MAX_RETRIES = 3
+SEND_BACKOFF_BASE_SEC = 1.0
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+SEND_QUEUE_LIMIT = int(os.getenv("SEND_QUEUE_LIMIT", "200"))
+
+# コンテスト告知ページ (Writer/Tester/配点) のキャッシュ
+# コンテスト後はほぼ変わらないので長めに持つ。未発表 (不明) の結果だけは短めに持つ
+DETAILS_CACHE_TTL_SEC = 6 * 3600
+DETAILS_UNKNOWN_TTL_SEC = 600
+DETAILS_FETCH_CONCURRENCY = 4
+
+# /status のプロフィール取得結果のキャッシュ
+# TTL 内はそのまま返し、STALE 内なら古い値を即返しつつ裏で取り直す
+STATUS_CACHE_TTL_SEC = 300
+STATUS_CACHE_STALE_SEC = 3600
+STATUS_CACHE_MAX = 1024
+
+# HTML 解析: lxml があれば使う (html.parser より数倍速い)
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+# 解析を走らせる先: "thread" (既定) か "process" (GIL も含めてイベントループから切り離す)
+# bench_parse でのループの最大遅れは thread で 50〜90ms (インラインは約160ms)、process で約5ms。
+# thread の遅れは SLOW_CALLBACK_SEC (0.1秒にしても) に届かないので遅延ログには出ない。気になるなら process にする
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "thread")
+PARSE_WORKERS = 2
+
+# 死活確認と /metrics を返す HTTP サーバー (bot と同じイベントループで動く)
+WEB_HOST = "0.0.0.0"
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# イベントループの詰まり調査
+LOOP_PROBE_INTERVAL_SEC = 0.5   # 遅延を測る間隔
+LOOP_LAG_WARN_SEC = 0.25        # これ以上遅れたらログに出す
+# 1回でこれ以上ループを占有したコールバックを記録する (秒)。0 なら記録しない (asyncio の内部を包まない)
+SLOW_CALLBACK_SEC = float(os.getenv("SLOW_CALLBACK_SEC", "0"))
+TRACE_KEEP = 500                # /debug/trace で返す直近の件数
+# /debug/trace はタスク名やコンテストID・AtCoder ID を含むので、このトークンを設定したときだけ公開する
+# (Authorization: Bearer <トークン> か ?token=<トークン> で取得)
+DEBUG_TRACE_TOKEN = os.getenv("DEBUG_TRACE_TOKEN", "")
+# 記録を JSON Lines で書き出すファイル (空なら書かない)。TRACE_FILE_BYTES ごとにローテーション
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_FILE_BYTES = 1 << 20
+TRACE_FILE_BACKUPS = 3
+
+# 共有 HTTP セッションの設定
+HTTP_LIMIT = 64            # 全体の同時接続数
+HTTP_LIMIT_PER_HOST = 8    # ホストごとの同時接続数
+HTTP_KEEPALIVE_SEC = 60    # 使い終わった接続を保持する秒数
+DNS_CACHE_SEC = 600
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10, sock_read=20)
+# 取得先の種類ごとのタイムアウト (無い種類は HTTP_TIMEOUT)。軽い API は短く、数MBのメタデータは長く待つ
+UPSTREAM_TIMEOUTS = {
+    "submissions": aiohttp.ClientTimeout(total=15, connect=5, sock_read=10),
+    "feed": aiohttp.ClientTimeout(total=30, connect=5, sock_read=20),
+    "page": aiohttp.ClientTimeout(total=15, connect=5, sock_read=10),
+    "history": aiohttp.ClientTimeout(total=10, connect=5),
+    "metadata": aiohttp.ClientTimeout(total=120, connect=10, sock_read=30),
+}
+# 接続エラー・タイムアウト・5xx・429 の再試行回数と、指数バックオフ (フルジッター) の基準・上限 (秒)
+# Retry-After や遮断器の待ち時間が上限を超えるときは、その場では待たずに諦める
+UPSTREAM_RETRIES = 2
+UPSTREAM_BACKOFF_BASE_SEC = 1.0
+UPSTREAM_BACKOFF_MAX_SEC = 8.0
+# ホストごとの遮断器: 連続 BREAKER_FAILURES 回失敗で開き、BREAKER_OPEN_SEC 秒 (試行に失敗するたび倍、上限あり) 送らない
+BREAKER_FAILURES = 5
+BREAKER_OPEN_SEC = 30
+BREAKER_MAX_OPEN_SEC = 600
+BREAKER_JITTER = 0.2
+BREAKER_STATES = ("closed", "half_open", "open")
+
+# 問題メタデータ (kenkoooo) のディスクキャッシュ
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+METADATA_URLS = {
+    "problems": "https://kenkoooo.com/atcoder/resources/problems.json",
+    "models": "https://kenkoooo.com/atcoder/resources/problem-models.json",
+}
+METADATA_REFRESH_HOURS = 6
+# 未知の problem_id を見たときの再取得は、この秒数に1回まで
+METADATA_MIN_REFRESH_SEC = 600
+
+# Sheets へのミラーはまとめて行う（この秒数ごとに変更分だけ反映）
+SHEETS_FLUSH_SEC = int(os.getenv("SHEETS_FLUSH_SEC", "60"))
+USER_SHEET_HEADER = ["GuildID", "AtCoderID", "DiscordID", "ChannelID", "OnlyAC", "LastSubID", "LastEpoch"]
+
 EMOJI_MAP = {
     "AC": "<:atcoder_bot_AC:1463065663429021917>",
     "WA": "<:atcoder_bot_WA:1463065707703959643>",
@@ -29,25 +182,1208 @@ EMOJI_MAP = {
 }
 
 
-class AtCoderBot(discord.Client):
+# --- HTML解析 ---
+# どれも文字列を受け取って dict / list だけを返す関数なので、別スレッド・別プロセスでそのまま動く。
+# SoupStrainer で必要な部分木だけを組み立て、ページ全体の木は作らない。
+
+def _has_class(name):
+    """SoupStrainer 用: 解析中は class 属性が分割前の文字列で渡ってくるので単語単位で比べる"""
+    return lambda value: bool(value) and name in value.split()
+
+
+def parse_contest_table(page, table_id=None, fingerprint=False):
+    """
+    コンテスト一覧の表を行ごとの dict にする。table_id を省くとページ最初の table を使う。
+    返り値: {"fp": 表の指紋, "rows": [{"time", "href", "name", "duration", "rated"}]} / 表が無ければ None
+    指紋 (表全体の sha1) は重いので fingerprint=True のときだけ計算する（それ以外は None）
+    """
+    only = SoupStrainer('div', id=table_id) if table_id else SoupStrainer('table')
+    soup = BeautifulSoup(page, HTML_PARSER, parse_only=only)
+    table = soup.find('div', id=table_id) if table_id else soup.find('table')
+    if not table: return None
+    rows = []
+    for row in table.find_all('tr')[1:]:
+        cols = row.find_all('td')
+        if len(cols) < 2: continue
+        time_tag = row.find('time')
+        a_tag = cols[1].find('a')
+        if not time_tag or not a_tag: continue
+        rows.append({
+            "time": time_tag.text.strip(),
+            "href": a_tag['href'],
+            "name": a_tag.text.strip(),
+            "duration": cols[2].text.strip() if len(cols) > 2 else None,
+            "rated": cols[3].text.strip() if len(cols) > 3 else None,
+        })
+    fp = hashlib.sha1(str(table).encode()).hexdigest() if fingerprint else None
+    return {"fp": fp, "rows": rows}
+
+
+def parse_profile(page, mode):
+    """プロフィールページのユーザー情報の行 (th/td) から各項目を取り出す"""
+    data = {}
+    soup = BeautifulSoup(page, HTML_PARSER, parse_only=SoupStrainer('tr'))
+    # ユーザー情報のテーブルを全スキャン
+    for row in soup.find_all('tr'):
+        th = row.find('th')
+        td = row.find('td')
+        if not th or not td: continue
+        
+        label = th.get_text(strip=True)
+        val = td.get_text(" ", strip=True).replace('―', '').strip()
+        
+        # 各種項目のマッピング
+        if label == "順位":
+            data["rank_all"] = val
+        elif "最高値" in label or "最高Rating" in label:
+            parts = val.split()
+            # Heuristic または 級が存在しない場合
+            if mode == 'heur' or len(parts) == 1:
+                data["max_rating"] = parts[0]
+            else:
+                # Algorithmかつ「級」が存在する場合
+                data["max_rating"] = f"{parts[0]} ({' '.join(parts[1:])})"
+        elif "参加回数" in label:
+            data["contest_count"] = val
+        elif "所属" in label:
+            data["org"] = val
+        elif "誕生年" in label:
+            data["birth"] = val
+    return data
+
+
+def parse_post_details(raw_html):
+    """告知ページ本文から Writer / Tester / 配点 を取り出す"""
+    info = {"writer": "不明", "tester": "不明", "points": "未発表"}
+    # 1. BeautifulSoupでデコードして、HTMLとしてパースする
+    decoded_html = html_lib.unescape(raw_html)
+    soup = BeautifulSoup(decoded_html, HTML_PARSER, parse_only=SoupStrainer('div', class_=_has_class('blog-post')))
+    post_body = soup.find('div', class_='blog-post')
+    
+    if post_body:
+        # 2. 【重要】タグの中の文字だけを抽出して繋げる
+        # 画像などのリンクの中にある名前もこれで抽出される
+        full_text = post_body.get_text("\n", strip=True)
+        
+        # 3. テキストからキーワードを探す
+        lines = full_text.splitlines()
+        for line in lines:
+            clean_line = line.replace(':', '：').lstrip('- ').strip()
+            
+            if 'Writer' in clean_line and '：' in clean_line:
+                info["writer"] = clean_line.split('：', 1)[-1].strip()
+            elif 'Tester' in clean_line and '：' in clean_line:
+                info["tester"] = clean_line.split('：', 1)[-1].strip()
+            elif '配点' in clean_line and '：' in clean_line:
+                info["points"] = clean_line.split('：', 1)[-1].strip()
+                
+        # --- バックアップ処理 ---
+        # もしWriterが「不明」のままなら、行をまたいでいる可能性があるので、
+        # テキスト全体からキーワードを探す
+        if info["writer"] == "不明":
+            if 'Writer：' in full_text:
+                # 'Writer：' の後の文字を抽出して、次のキーワードまでを取る
+                # (このコンテストの場合、Testerの手前まで)
+                part = full_text.split('Writer：', 1)[-1]
+                info["writer"] = part.split('Tester：', 1)[0].strip()
+    return info
+
+
+def parse_home_announcements(page):
+    """ホームのお知らせ欄から {コンテストURL: {writer, tester, points}} を作る"""
+    results = {}
+    soup = BeautifulSoup(page, HTML_PARSER, parse_only=SoupStrainer('div', class_=_has_class('panel-default')))
+    for post in soup.find_all('div', class_='panel-default'):
+        body = post.find('div', class_='panel-body blog-post')
+        if not body: continue
+        
+        # コンテストURLの取得と正規化
+        link_tag = body.find('a', href=re.compile(r'https://atcoder\.jp/contests/[^" \n]+'))
+        if not link_tag: continue
+        c_url = link_tag['href'].split('?')[0].rstrip('/')
+        
+        info = {"writer": "不明", "tester": "不明", "points": "未発表"}
+
+        # 名前を抽出する専用ロジック (aタグの中身を拾う)
+        def extract_users(keyword):
+            target = body.find(string=re.compile(keyword))
+            if not target: return None
+            # キーワードの親要素から /users/ リンクを持つaタグをすべて取得
+            links = target.parent.find_all('a', href=re.compile(r'/users/'))
+            return ", ".join([u.get_text(strip=True) for u in links]) if links else None
+
+        info["writer"] = extract_users("Writer") or "不明"
+        info["tester"] = extract_users("Tester") or "不明"
+
+        # 配点のパース (テキストから取得)
+        content_text = body.get_text("|", strip=True)
+        for line in content_text.split("|"):
+            if "配点：" in line or "配点:" in line:
+                info["points"] = line.split("：")[-1].split(":")[-1].strip()
+        
+        results[c_url] = info
+    return results
+
+
+# --- 時計 ---
+class Clock:
+    """
+    予定・間隔の判断に使う現在時刻。time.time / time.monotonic / datetime.now を直接読まずにこれを通す。
+    シミュレーション (bench/simulate.py) では仮想時刻を返すものに差し替える。
+    """
+    def time(self): return time.time()
+    def monotonic(self): return time.monotonic()
+    def now(self, tz=JST): return datetime.fromtimestamp(self.time(), tz)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+# --- 流量制限 ---
+class TokenBucket:
+    """rate 個/秒で補充され、最大 burst 個まで貯まるトークンバケット"""
+    def __init__(self, rate, burst, clock=SYSTEM_CLOCK):
+        self.rate, self.burst = rate, burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = self.clock.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """URLのホスト名ごとに TokenBucket を割り当てる"""
+    def __init__(self, limits=None, default=DEFAULT_RATE_LIMIT, clock=SYSTEM_CLOCK):
+        self.limits = limits if limits is not None else HOST_RATE_LIMITS
+        self.default = default
+        self.clock = clock
+        self.buckets = {}
+        # ホストごとの累計リクエスト数
+        self.counts = {}
+
+    async def acquire(self, url):
+        host = urlsplit(url).hostname or ""
+        self.counts[host] = self.counts.get(host, 0) + 1
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(*self.limits.get(host, self.default), clock=self.clock)
+        await bucket.acquire()
+
+
+# --- 上流の障害対策 ---
+class UpstreamError(Exception):
+    """再試行しても上流から正常な応答が得られなかった"""
+    def __init__(self, host, reason):
+        super().__init__(f"{host}: {reason}")
+        self.host = host
+
+
+class UpstreamUnavailable(UpstreamError):
+    """遮断器が開いているので送らなかった"""
+
+
+def parse_retry_after(value, now):
+    """Retry-After (秒数か HTTP 日付) を今から待つ秒数にする。無い・読めないときは None"""
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try: return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError): return None
+
+
+def backoff_delay(attempt):
+    """attempt 回目の再試行までの待ち時間 (指数バックオフ + フルジッター)"""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX_SEC, UPSTREAM_BACKOFF_BASE_SEC * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    1ホスト分の遮断器。
+    closed: 普通に送る。連続 BREAKER_FAILURES 回失敗すると open にする。
+    open: 待ち時間が過ぎるまで送らない。過ぎたら1件だけ試しに通す (half_open)。
+    half_open: 試しの1件が成功すれば closed、失敗すれば待ち時間を倍にして open に戻す。
+    Retry-After を受け取ったときは回数に関係なく、その秒数だけ open にする。
+    """
+    def __init__(self, host, threshold=BREAKER_FAILURES, base=BREAKER_OPEN_SEC, cap=BREAKER_MAX_OPEN_SEC, clock=SYSTEM_CLOCK):
+        self.host, self.threshold, self.base, self.cap = host, threshold, base, cap
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.until = 0.0
+        self.open_sec = 0
+        self.opened_at = 0.0
+        # 遮断した回数 / 遮断中で送らなかった回数 / 再試行した回数
+        self.trips = self.rejected = self.retries = 0
+
+    def available(self):
+        return self.state == "closed" or self.clock.monotonic() >= self.until
+
+    def retry_in(self):
+        return 0.0 if self.state == "closed" else max(0.0, self.until - self.clock.monotonic())
+
+    def allow(self):
+        """送ってよければ True。open の待ち時間が過ぎていれば half_open にして1件だけ通す"""
+        if self.state == "closed": return True
+        now = self.clock.monotonic()
+        if now < self.until:
+            self.rejected += 1
+            return False
+        # 試しの1件が返らないまま消えても、もう1周期たてば次を通せるように期限を延ばしておく
+        self.state, self.until = "half_open", now + max(self.open_sec, self.base)
+        print(f"🔍 {self.host}: 遮断中の試行")
+        return True
+
+    def success(self):
+        if self.state != "closed":
+            print(f"✅ {self.host}: 復旧 (遮断 {self.clock.monotonic() - self.opened_at:.0f}秒)")
+        self.state, self.failures, self.open_sec = "closed", 0, 0
+
+    def failure(self, reason, retry_after=None):
+        now = self.clock.monotonic()
+        self.failures += 1
+        if self.state == "open":
+            # 開く前に送っていたリクエストの失敗は数えるだけ（Retry-After がもっと先なら延ばす）
+            if retry_after is not None: self.until = max(self.until, now + retry_after)
+            return
+        tripped = self.state == "half_open" or self.failures >= self.threshold
+        if not tripped and retry_after is None: return
+        wait = retry_after or 0.0
+        if tripped:
+            self.open_sec = min(self.cap, self.open_sec * 2 if self.open_sec else self.base)
+            wait = max(wait, self.open_sec * random.uniform(1 - BREAKER_JITTER, 1 + BREAKER_JITTER))
+            self.trips += 1
+            print(f"🔌 {self.host}: 連続{self.failures}回失敗 ({reason})、{wait:.0f}秒間遮断")
+        else:
+            print(f"⏳ {self.host}: Retry-After {wait:.0f}秒 ({reason})")
+        if self.state == "closed": self.opened_at = now
+        self.state, self.until = "open", now + wait
+
+
+class HostBreakers:
+    """ホスト名ごとに CircuitBreaker を割り当てる"""
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.by_host = {}
+
+    def get(self, host):
+        breaker = self.by_host.get(host)
+        if breaker is None:
+            breaker = self.by_host[host] = CircuitBreaker(host, clock=self.clock)
+        return breaker
+
+    def available(self, host):
+        breaker = self.by_host.get(host)
+        return breaker is None or breaker.available()
+
+
+# --- ローカルDB ---
+class Store:
+    """
+    登録・告知チャンネル・送信済み通知・カーソルを保持する SQLite (WAL)。
+    1件ずつのローカル書き込みはミリ秒未満なので、イベントループから直接呼ぶ。
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS registrations (
+        guild_id INTEGER NOT NULL,
+        atcoder_id TEXT NOT NULL,
+        discord_user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        only_ac INTEGER NOT NULL,
+        last_sub_id INTEGER NOT NULL DEFAULT 0,
+        last_epoch INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, atcoder_id)
+    );
+    CREATE TABLE IF NOT EXISTS news_channels (
+        guild_id INTEGER PRIMARY KEY,
+        channel_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sent_notifications (
+        key TEXT PRIMARY KEY,
+        sent_at INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS cursors (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS contests (
+        contest_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def load_registrations(self):
+        rows = self.conn.execute(
+            "SELECT guild_id, atcoder_id, discord_user_id, channel_id, only_ac, last_sub_id, last_epoch FROM registrations")
+        return [Registration(*row) for row in rows]
+
+    def save_registrations(self, infos):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO registrations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(v.guild_id, v.atcoder_id, v.discord_user_id, v.channel_id, int(v.only_ac),
+                  v.last_sub_id, v.last_epoch) for v in infos])
+
+    def delete_registration(self, guild_id, atcoder_id):
+        self.conn.execute("DELETE FROM registrations WHERE guild_id = ? AND atcoder_id = ?", (guild_id, atcoder_id))
+
+    def load_news_channels(self):
+        return {str(g): c for g, c in self.conn.execute("SELECT guild_id, channel_id FROM news_channels")}
+
+    def set_news_channel(self, guild_id, channel_id):
+        self.conn.execute("INSERT OR REPLACE INTO news_channels VALUES (?, ?)", (int(guild_id), channel_id))
+
+    def delete_news_channel(self, guild_id):
+        self.conn.execute("DELETE FROM news_channels WHERE guild_id = ?", (int(guild_id),))
+
+    def load_sent(self, since):
+        return dict(self.conn.execute("SELECT key, sent_at FROM sent_notifications WHERE sent_at >= ?", (int(since),)))
+
+    def add_sent(self, key, sent_at):
+        self.conn.execute("INSERT OR REPLACE INTO sent_notifications VALUES (?, ?)", (key, int(sent_at)))
+
+    def delete_sent(self, key):
+        self.conn.execute("DELETE FROM sent_notifications WHERE key = ?", (key,))
+
+    def prune_sent(self, before):
+        self.conn.execute("DELETE FROM sent_notifications WHERE sent_at < ?", (int(before),))
+
+    def get_cursor(self, name, default=0):
+        row = self.conn.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_cursor(self, name, value):
+        self.conn.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?)", (name, int(value)))
+
+    def load_contests(self):
+        contests = {}
+        for c_id, raw in self.conn.execute("SELECT contest_id, data FROM contests"):
+            data = json.loads(raw)
+            data['start'] = datetime.fromisoformat(data['start'])
+            data['end'] = datetime.fromisoformat(data['end'])
+            contests[c_id] = data
+        return contests
+
+    def save_contest(self, c_id, data):
+        raw = json.dumps(dict(data, start=data['start'].isoformat(), end=data['end'].isoformat()), ensure_ascii=False)
+        self.conn.execute("INSERT OR REPLACE INTO contests VALUES (?, ?)", (c_id, raw))
+
+    def delete_contest(self, c_id):
+        self.conn.execute("DELETE FROM contests WHERE contest_id = ?", (c_id,))
+
+
+# --- Discord 送信キュー ---
+class PriorityGate:
+    """
+    同時実行数を limit に抑えるゲート。空きを待つものは (優先度, 到着順) の順に通す。
+    どのチャンネルで待っていても、コンテスト告知は提出通知より先に空きをもらえる。
+    """
+    def __init__(self, limit):
+        self.free = limit
+        self.waiters = []  # (優先度, 通し番号, Future)
+        self.seq = 0
+
+    async def acquire(self, priority):
+        if self.free > 0:
+            self.free -= 1
+            return
+        self.seq += 1
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, self.seq, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 空きを渡された直後に取り消されたら、その空きを次に回す
+            if fut.done() and not fut.cancelled(): self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, fut = heapq.heappop(self.waiters)
+            if not fut.done():
+                fut.set_result(None)  # 空きをそのまま渡す
+                return
+        self.free += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority):
+        await self.acquire(priority)
+        try: yield
+        finally: self.release()
+
+
+class OutboundQueue:
+    """
+    Discord への送信をすべてここに積み、チャンネルごとのワーカーが優先度順に送る。
+    同時送信数の枠 (PriorityGate) もチャンネルをまたいで優先度順に割り当てる。
+    積む側 (提出チェックや通知タスク) は送信の完了を待たない。
+    submit は送信結果 (Message) か最終的な例外が入る Future を返す。
+    """
+    def __init__(self, concurrency=SEND_CONCURRENCY, limit=SEND_QUEUE_LIMIT, clock=SYSTEM_CLOCK):
+        self.limit = limit
+        self.clock = clock
+        self.gate = PriorityGate(concurrency)
+        self.channels = {}  # channel_id → {"heap": [(優先度, 通し番号, 送信関数, Future, 積んだ時刻)], "task"}
+        self.seq = 0
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "retried": 0, "dropped": 0,
+                      "max_depth": 0, "latency_sum": 0.0, "send_sum": 0.0}
+
+    def depth(self):
+        return sum(len(c["heap"]) for c in self.channels.values())
+
+    def submit(self, channel_id, priority, send):
+        """send は呼ぶたびに送信コルーチンを返す関数（再試行で呼び直すため）"""
+        fut = asyncio.get_running_loop().create_future()
+        # 誰も結果を見ない送信 (提出通知など) で「例外が取り出されていない」警告を出さないため
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        c = self.channels.setdefault(channel_id, {"heap": [], "task": None})
+        if len(c["heap"]) >= self.limit and priority >= PRIORITY_AC:
+            # 溢れたときは提出通知を諦め、告知は必ず受け付ける
+            self.stats["dropped"] += 1
+            fut.set_exception(asyncio.QueueFull(f"送信キューが満杯です ({channel_id})"))
+            return fut
+        self.seq += 1
+        heapq.heappush(c["heap"], (priority, self.seq, send, fut, self.clock.monotonic()))
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(c["heap"]))
+        if c["task"] is None:
+            c["task"] = asyncio.create_task(self._worker(channel_id, c), name=f"send:{channel_id}")
+        return fut
+
+    async def _worker(self, channel_id, c):
+        try:
+            while c["heap"]:
+                priority, _, send, fut, queued_at = heapq.heappop(c["heap"])
+                try:
+                    result = await self._send_with_retry(send, priority)
+                    self.stats["sent"] += 1
+                    self.stats["latency_sum"] += self.clock.monotonic() - queued_at
+                    if not fut.done(): fut.set_result(result)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"❌ 送信失敗 ({channel_id}): {e}")
+                    if not fut.done(): fut.set_exception(e)
+        finally:
+            c["task"] = None
+            if not c["heap"]: self.channels.pop(channel_id, None)
+
+    async def _send_with_retry(self, send, priority):
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            try:
+                async with self.gate.slot(priority):
+                    started = self.clock.monotonic()
+                    result = await send()
+                    self.stats["send_sum"] += self.clock.monotonic() - started
+                    return result
+            except (discord.Forbidden, discord.NotFound):
+                raise  # 権限なし・削除済みは何度やっても同じ
+            except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                if isinstance(e, discord.HTTPException) and e.status < 500 and e.status != 429: raise
+                if attempt == SEND_MAX_RETRIES: raise
+                self.stats["retried"] += 1
+                await asyncio.sleep(SEND_BACKOFF_BASE_SEC * 2 ** attempt * (1 + random.random()))
+
+    def snapshot(self):
+        s = dict(self.stats, depth=self.depth(), channels=len(self.channels))
+        s["avg_latency"] = s.pop("latency_sum") / s["sent"] if s["sent"] else 0.0
+        s["avg_send"] = s.pop("send_sum") / s["sent"] if s["sent"] else 0.0
+        return s
+
+    async def drain(self, timeout=10):
+        """終了時に残りを送り切る（最大 timeout 秒）"""
+        tasks = [c["task"] for c in self.channels.values() if c["task"]]
+        if tasks: await asyncio.wait(tasks, timeout=timeout)
+
+
+# --- 通知のまとめ送り ---
+class EmbedBatcher:
+    """
+    チャンネルごとに Embed を短時間ためて、最大10個ずつのメッセージにして送信キューへ積む。
+    キューは同じ優先度なら積んだ順に送るので、提出の順番は保たれる。
+    add は Embed を含むメッセージの送信結果 (Message か例外) が入る Future を返す。
+    """
+    def __init__(self, outbound, window=AC_BATCH_WINDOW_SEC, max_delay=AC_BATCH_MAX_DELAY_SEC, clock=SYSTEM_CLOCK):
+        self.outbound = outbound
+        self.clock = clock
+        self.window, self.max_delay = window, max_delay
+        self.pending = {}  # channel.id → {"channel", "embeds", "futures", "last", "full"}
+        self.tasks = set()
+
+    def add(self, channel, embed):
+        b = self.pending.get(channel.id)
+        if b is None:
+            b = self.pending[channel.id] = {"channel": channel, "embeds": [], "futures": [], "last": 0.0,
+                                            "full": asyncio.Event()}
+            task = asyncio.create_task(self._drain(channel.id, b), name=f"ac_batch:{channel.id}")
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        b["embeds"].append(embed)
+        b["futures"].append(fut)
+        b["last"] = self.clock.monotonic()
+        if len(b["embeds"]) >= MAX_EMBEDS_PER_MESSAGE: b["full"].set()
+        return fut
+
+    async def _drain(self, channel_id, b):
+        started = self.clock.monotonic()
+        while not b["full"].is_set():
+            wait = min(b["last"] + self.window, started + self.max_delay) - self.clock.monotonic()
+            if wait <= 0: break
+            try: await asyncio.wait_for(b["full"].wait(), wait)
+            except asyncio.TimeoutError: pass
+        self._submit(channel_id, b)
+
+    def _submit(self, channel_id, b):
+        # ここから先に来た Embed は次のまとまりに入る
+        if self.pending.get(channel_id) is not b: return
+        del self.pending[channel_id]
+        channel, embeds = b["channel"], b["embeds"]
+        for i in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE):
+            chunk = embeds[i:i + MAX_EMBEDS_PER_MESSAGE]
+            sent = self.outbound.submit(channel_id, PRIORITY_AC, lambda chunk=chunk: channel.send(embeds=chunk))
+            sent.add_done_callback(functools.partial(self._settle, b["futures"][i:i + MAX_EMBEDS_PER_MESSAGE]))
+
+    @staticmethod
+    def _settle(futures, sent):
+        """メッセージの送信結果を、そこに入っていた Embed ごとの Future に伝える"""
+        for fut in futures:
+            if fut.done(): continue
+            if sent.cancelled(): fut.cancel()
+            elif sent.exception(): fut.set_exception(sent.exception())
+            else: fut.set_result(sent.result())
+
+    def flush(self):
+        """溜まっている分を待たずにすべてキューへ積む（終了時用）"""
+        for cid, b in list(self.pending.items()):
+            self._submit(cid, b)
+
+
+# --- 応答キャッシュ ---
+class SWRCache:
+    """
+    fetch(key) の結果を持つ stale-while-revalidate キャッシュ。
+    同じ鍵への同時アクセスは1回の取得を共有する。None (取得失敗) は保存しない。
+    """
+    def __init__(self, fetch, ttl, stale_ttl, maxsize, clock=SYSTEM_CLOCK):
+        self.fetch, self.ttl, self.stale_ttl, self.maxsize = fetch, ttl, stale_ttl, maxsize
+        self.clock = clock
+        self.entries = {}   # 鍵 → (保存時刻, 値)。挿入順を LRU 代わりに使う
+        self.inflight = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry:
+            age = self.clock.monotonic() - entry[0]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                self._touch(key, entry)
+                return entry[1]
+            if age < self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._touch(key, entry)
+                if key not in self.inflight:
+                    self.stats["refreshes"] += 1
+                    self._start(key)
+                return entry[1]
+        self.stats["misses"] += 1
+        task = self.inflight.get(key) or self._start(key)
+        return await asyncio.shield(task)
+
+    def _touch(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+
+    def _start(self, key):
+        task = self.inflight[key] = asyncio.create_task(self._load(key), name=f"swr:{key}")
+        task.add_done_callback(lambda t: self.inflight.pop(key, None))
+        return task
+
+    async def _load(self, key):
+        try:
+            value = await self.fetch(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"⚠️ キャッシュ更新失敗 ({key}): {e}")
+            return None
+        if value is None:
+            self.stats["errors"] += 1
+            # 失敗時は古い値があればそれを使い続ける
+            entry = self.entries.get(key)
+            return entry[1] if entry else None
+        self._touch(key, (self.clock.monotonic(), value))
+        while len(self.entries) > self.maxsize:
+            del self.entries[next(iter(self.entries))]
+        return value
+
+
+# --- 送信済み通知 ---
+class SentNotices:
+    """
+    送信済みのコンテスト通知を「コンテストID:種類」で覚えておく重複防止ストア。
+    ローカルDBにも書くので再起動をまたいでも二重送信しない。
+    ttl 秒より古い記録は捨てるので、何か月動かしても大きくならない。
+    """
+    PRUNE_INTERVAL_SEC = 3600
+
+    def __init__(self, store, ttl=SENT_NOTICE_TTL_SEC, clock=SYSTEM_CLOCK):
+        self.store, self.ttl = store, ttl
+        self.clock = clock
+        self.sent = {}  # 鍵 → 送信時刻 (epoch)
+        self.pruned_at = 0.0
+
+    @staticmethod
+    def key(contest_id, kind):
+        return f"{contest_id}:{kind}"
+
+    def load(self):
+        self.prune()
+        self.sent = self.store.load_sent(self.clock.time() - self.ttl)
+
+    def __contains__(self, key):
+        return key in self.sent
+
+    def __len__(self):
+        return len(self.sent)
+
+    def add(self, key):
+        now = self.clock.time()
+        self.sent[key] = now
+        self.store.add_sent(key, now)
+        if now - self.pruned_at >= self.PRUNE_INTERVAL_SEC: self.prune()
+
+    def discard(self, key):
+        """予定が変わって送り直す通知の記録を消す"""
+        if self.sent.pop(key, None) is not None: self.store.delete_sent(key)
+
+    def prune(self):
+        now = self.clock.time()
+        cutoff = now - self.ttl
+        self.sent = {k: t for k, t in self.sent.items() if t >= cutoff}
+        self.store.prune_sent(cutoff)
+        self.pruned_at = now
+
+
+# --- 登録ユーザー ---
+class Registration:
+    """1サーバーでの1件の提出通知登録"""
+    __slots__ = ("guild_id", "atcoder_id", "discord_user_id", "channel_id", "only_ac", "last_sub_id", "last_epoch",
+                 "queued_sub_id", "queued_epoch", "inflight")
+
+    def __init__(self, guild_id, atcoder_id, discord_user_id, channel_id, only_ac=True, last_sub_id=0, last_epoch=0):
+        self.guild_id = int(guild_id)
+        self.atcoder_id = atcoder_id
+        self.discord_user_id = int(discord_user_id)
+        self.channel_id = int(channel_id)
+        self.only_ac = bool(only_ac)
+        self.last_sub_id = int(last_sub_id)
+        self.last_epoch = int(last_epoch)
+        # 送信キューまで積んだ位置と、送信待ちの提出 {提出ID: epoch_second}（保存しない）
+        # last_sub_id / last_epoch は送信が終わった分までしか進めない
+        self.queued_sub_id = self.last_sub_id
+        self.queued_epoch = self.last_epoch
+        self.inflight = {}
+
+    @property
+    def key(self):
+        # 「サーバーID_ユーザー名」で固有の鍵を作る
+        return f"{self.guild_id}_{self.atcoder_id}"
+
+    def __repr__(self):
+        return f"Registration({self.key}, discord={self.discord_user_id}, channel={self.channel_id})"
+
+
+class UserRegistry:
+    """
+    Registration を鍵で持ち、Discordユーザー / AtCoder ID から O(1) で引ける索引を併せ持つ。
+    追加・削除は索引ごと一度に行う（途中で await しないので他のタスクから中途半端な状態は見えない）。
+    """
+    INDEXED = {"discord_user_id": "by_discord", "atcoder_id": "by_atcoder"}
+
     def __init__(self):
+        self.by_key = {}
+        self.by_discord, self.by_atcoder = {}, {}
+
+    def __len__(self): return len(self.by_key)
+    def __iter__(self): return iter(list(self.by_key.values()))
+    def __contains__(self, key): return key in self.by_key
+
+    def get(self, key):
+        return self.by_key.get(key)
+
+    def _index(self, reg):
+        for field, name in self.INDEXED.items():
+            getattr(self, name).setdefault(getattr(reg, field), {})[reg.key] = reg
+
+    def _unindex(self, reg):
+        for field, name in self.INDEXED.items():
+            index = getattr(self, name)
+            bucket = index.get(getattr(reg, field))
+            if bucket is None: continue
+            bucket.pop(reg.key, None)
+            if not bucket: del index[getattr(reg, field)]
+
+    def add(self, reg):
+        """同じ鍵の登録があれば置き換える"""
+        old = self.by_key.get(reg.key)
+        if old: self._unindex(old)
+        self.by_key[reg.key] = reg
+        self._index(reg)
+        return reg
+
+    def remove(self, key):
+        reg = self.by_key.pop(key, None)
+        if reg: self._unindex(reg)
+        return reg
+
+    def for_discord_user(self, discord_user_id): return list(self.by_discord.get(discord_user_id, {}).values())
+
+
+# --- イベントループの監視 ---
+class LoopMonitor:
+    """
+    イベントループの詰まりを調べる。
+    - probe: 一定間隔で眠り、予定より何秒遅れて起きたか (ループ遅延) を測る
+    - install: 1回のコールバックが slow_sec を超えたら、それを動かしたタスクと await の連なりを記録する
+      （全コールバックに手が入るので、SLOW_CALLBACK_SEC > 0 のときだけ仕掛ける）
+    - span: with で囲んだ処理の所要時間を、実行中のタスク名と一緒に記録する
+    直近の記録はメモリに持ち、path があれば JSON Lines で書き出す（ローテーションあり）。
+    """
+    _orig_run = None
+
+    def __init__(self, slow_sec=SLOW_CALLBACK_SEC, keep=TRACE_KEEP, path=TRACE_FILE):
+        self.slow_sec = slow_sec
+        self.lag = {"last": 0.0, "max": 0.0, "sum": 0.0, "count": 0}
+        self.slow = deque(maxlen=keep)
+        self.spans = deque(maxlen=keep)
+        self.slow_counts = {}  # タスク名 → 遅いコールバックの回数
+        self.log = None
+        if path:
+            self.log = logging.getLogger("atcoder_bot.trace")
+            self.log.propagate = False
+            self.log.setLevel(logging.INFO)
+            if not self.log.handlers:
+                self.log.addHandler(logging.handlers.RotatingFileHandler(
+                    path, maxBytes=TRACE_FILE_BYTES, backupCount=TRACE_FILE_BACKUPS, encoding="utf-8"))
+
+    def install(self):
+        """asyncio の Handle._run を包み、コールバックごとの実行時間を測る（debug モードは使わない）"""
+        if LoopMonitor._orig_run is None: LoopMonitor._orig_run = asyncio.events.Handle._run
+        orig, monitor = LoopMonitor._orig_run, self
+        def _run(handle):
+            # タスクが再開する位置 (= このコールバックで動くコード) は実行後には次の await 先に変わっているので、
+            # 先に code オブジェクトだけ控える（名前の文字列は遅かったときだけ作る）
+            task = getattr(handle._callback, "__self__", None)
+            codes = monitor.await_codes(task.get_coro()) if isinstance(task, asyncio.Task) else None
+            started = time.perf_counter()
+            orig(handle)
+            elapsed = time.perf_counter() - started
+            if elapsed >= monitor.slow_sec: monitor.slow_callback(handle, elapsed, codes)
+        asyncio.events.Handle._run = _run
+
+    @staticmethod
+    def await_codes(coro):
+        """タスクのコルーチンから await 先をたどった code オブジェクトの並び（中断中の位置）"""
+        codes = []
+        while coro is not None and hasattr(coro, "cr_code"):
+            codes.append(coro.cr_code)
+            coro = coro.cr_await
+        return codes
+
+    @staticmethod
+    def await_chain(codes):
+        """await_codes の結果を 'check_submissions > process_submissions' の形にする"""
+        return " > ".join(c.co_name for c in codes if c.co_name != "_traced")
+
+    def slow_callback(self, handle, elapsed, codes=None):
+        """codes は実行前に控えた await の連なり（ループを占有したコードの位置）"""
+        task = getattr(handle._callback, "__self__", None)
+        if isinstance(task, asyncio.Task):
+            name, stack = task.get_name(), self.await_chain(codes or [])
+        else:
+            name = stack = getattr(handle._callback, "__qualname__", repr(handle._callback))
+        self.slow_counts[name] = self.slow_counts.get(name, 0) + 1
+        self.record(self.slow, {"type": "slow", "task": name, "stack": stack, "ms": round(elapsed * 1000, 1)})
+        print(f"🐢 ループ占有 {elapsed * 1000:.0f}ms ({name}: {stack})")
+
+    async def probe(self, interval=LOOP_PROBE_INTERVAL_SEC):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.monotonic() - started - interval)
+            self.lag["last"] = lag
+            self.lag["max"] = max(self.lag["max"], lag)
+            self.lag["sum"] += lag
+            self.lag["count"] += 1
+            if lag >= LOOP_LAG_WARN_SEC:
+                self.record(self.slow, {"type": "lag", "ms": round(lag * 1000, 1)})
+                print(f"🐢 ループ遅延 {lag * 1000:.0f}ms")
+
+    @contextlib.contextmanager
+    def span(self, name):
+        task = asyncio.current_task()
+        started, wall = time.perf_counter(), time.time()
+        try:
+            yield
+        finally:
+            self.record(self.spans, {"type": "span", "name": name, "task": task.get_name() if task else None,
+                                     "at": round(wall, 3), "ms": round((time.perf_counter() - started) * 1000, 1)})
+
+    def record(self, buf, entry):
+        entry.setdefault("at", round(time.time(), 3))
+        buf.append(entry)
+        if self.log: self.log.info(json.dumps(entry, ensure_ascii=False))
+
+    def snapshot(self):
+        lag = dict(self.lag, avg=self.lag["sum"] / self.lag["count"] if self.lag["count"] else 0.0)
+        return {"lag": lag, "slow_counts": self.slow_counts, "slow": list(self.slow), "spans": list(self.spans)}
+
+
+def traced(func):
+    """AtCoderBot のコルーチンメソッドを self.monitor.span で囲む"""
+    @functools.wraps(func)
+    async def _traced(self, *args, **kwargs):
+        with self.monitor.span(func.__name__):
+            return await func(self, *args, **kwargs)
+    return _traced
+
+
+# --- 問題カタログ ---
+class ProblemCatalog:
+    """
+    問題ID → タイトル / difficulty の省メモリな対応表。
+    problem-models.json をそのまま dict で持つと1問あたり十数個の float を抱えるので、
+    ID を連番に振り、タイトルは1本の文字列に詰め、difficulty は double の配列で持つ。
+    更新は with_titles / with_difficulties で新しいカタログを作って差し替える。
+    """
+    __slots__ = ("index", "titles", "title_end", "diffs")
+
+    def __init__(self, index=None, titles="", title_end=None, diffs=None):
+        self.index = index if index is not None else {}  # 問題ID → 連番
+        self.titles = titles                              # 全タイトルを連結した文字列
+        self.title_end = title_end if title_end is not None else array('I')  # 各タイトルの終端位置
+        self.diffs = diffs if diffs is not None else array('d')              # difficulty (無ければ NaN)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, problem_id):
+        # タイトルが分かっている問題だけを「既知」とみなす
+        return self.title(problem_id) is not None
+
+    def title(self, problem_id, default=None):
+        i = self.index.get(problem_id)
+        if i is None: return default
+        start = self.title_end[i - 1] if i else 0
+        end = self.title_end[i]
+        return self.titles[start:end] if end > start else default
+
+    def difficulty(self, problem_id):
+        i = self.index.get(problem_id)
+        if i is None: return None
+        d = self.diffs[i]
+        return None if math.isnan(d) else d
+
+    def _extend_index(self, ids):
+        index = dict(self.index)
+        for pid in ids:
+            if pid not in index: index[sys.intern(pid)] = len(index)
+        return index
+
+    def with_titles(self, problems):
+        """problems.json (list of {id, title}) のタイトルに差し替えたカタログを返す"""
+        titles = {x['id']: x['title'] for x in problems}
+        index = self._extend_index(titles)
+        order = sorted(index, key=index.get)
+        parts, ends, pos = [], array('I'), 0
+        for pid in order:
+            t = titles.get(pid) or ""
+            parts.append(t)
+            pos += len(t)
+            ends.append(pos)
+        diffs = array('d', self.diffs)
+        diffs.extend([math.nan] * (len(index) - len(diffs)))
+        return ProblemCatalog(index, "".join(parts), ends, diffs)
+
+    def with_difficulties(self, models):
+        """problem-models.json ({id: {difficulty, ...}}) の difficulty に差し替えたカタログを返す"""
+        index = self._extend_index(models)
+        diffs = array('d', [math.nan]) * len(index)
+        for pid, m in models.items():
+            d = m.get('difficulty')
+            if d is not None: diffs[index[pid]] = d
+        ends = array('I', self.title_end)
+        ends.extend([ends[-1] if ends else 0] * (len(index) - len(ends)))
+        return ProblemCatalog(index, self.titles, ends, diffs)
+
+    def with_data(self, name, data):
+        return self.with_titles(data) if name == "problems" else self.with_difficulties(data)
+
+
+class AtCoderBot(discord.Client):
+    def __init__(self, clock=None):
         intents = discord.Intents.default()
         intents.members = True
         super().__init__(intents=intents)
+        # 予定・間隔の判断に使う時計（シミュレーションでは仮想時刻）
+        self.clock = clock or SYSTEM_CLOCK
         self.tree = app_commands.CommandTree(self)
-        self.user_data = {}
+        self.registry = UserRegistry()
         self.news_config = {}
-        self.problems_map = {}
-        self.diff_map = {}
-        self.sent_notifications = set()
+        self.problems = ProblemCatalog()
         self.pending_contests = {}
-        
+        # 提出チェックの予定 {atcoder_id: [次に問い合わせる時刻 (monotonic), 現在の間隔 (秒)]}
+        self.poll_schedule = {}
+        self.feed_due = 0.0
+        # コンテスト通知の予定 (発火時刻, 通し番号, コンテストID, 種類) の最小ヒープ
+        self.notice_heap = []
+        self.notice_seq = 0
+        self.notice_wakeup = asyncio.Event()
+        # 予定表の前回の指紋と、まだ予約範囲外のコンテスト行 {c_id: 行の内容}
+        self.calendar_fp = None
+        self.calendar_later = {}
+        self.rate_limiter = HostRateLimiter(clock=self.clock)
+        self.breakers = HostBreakers(clock=self.clock)
+        self.outbound = OutboundQueue(clock=self.clock)
+        self.ac_batcher = EmbedBatcher(self.outbound, clock=self.clock)
+        # 直近のコンテスト告知の配信結果と、参照を保持しておく裏タスク
+        self.broadcast_stats = {}
+        self.background_tasks = set()
+        # 直近の提出チェック1周分の計測結果
+        self.poll_stats = {}
+        # フィード方式で最後に読んだ epoch_second と、送れなかった提出のうち最も古い epoch_second
+        self.feed_cursor = 0
+        self.feed_retry_epoch = None
+        # Sheets 未反映の登録キー / 行番号の対応 / 削除があって全体の書き直しが必要か
+        self.dirty_keys = set()
+        self.sheet_rows = {}
+        self.sheet_rewrite = False
+        # Sheets からの移行が済む前に削除された登録（取り込みで生き返らせない）
+        self.removed_before_import = set()
+        self.sheet = None
+        self.store = Store(DB_PATH)
+        self.sent_notifications = SentNotices(self.store, clock=self.clock)
+        # setup_hook で作る共有セッションと、その接続の新規作成/再利用回数
+        self.session = None
+        self.http_stats = {"requests": 0, "connections": 0, "reused": 0}
+        # ホストごとの {"requests", "errors", "latency_sum"}（/metrics 用）
+        self.host_stats = {}
+        # 提出チェックの累計と Sheets への書き込み回数（/metrics 用）
+        self.poll_totals = {"cycles": 0, "seconds": 0.0, "paused": 0}
+        self.sheet_stats = {"rewrites": 0, "patches": 0, "rows": 0, "failures": 0}
+        self.web_runner = None
+        # ループ遅延・遅いコールバック・処理時間の記録 (/debug/trace と /metrics 用)
+        self.monitor = LoopMonitor()
+        # 問題メタデータの ETag / Last-Modified と最終更新確認時刻
+        self.metadata_validators = {}
+        self.metadata_checked = 0.0
+        self.metadata_lock = asyncio.Lock()
+        # 告知ページの詳細 {contest_id: (取得時刻, info)} と取得中のタスク
+        self.details_cache = {}
+        self.details_inflight = {}
+        # /status 用のプロフィール {(atcoder_id, mode): fetch_user_data の結果}
+        self.status_cache = SWRCache(lambda key: self.fetch_user_data(self.session, *key),
+                                     STATUS_CACHE_TTL_SEC, STATUS_CACHE_STALE_SEC, STATUS_CACHE_MAX, clock=self.clock)
+        # HTML 解析はイベントループの外で行う
+        pool = ProcessPoolExecutor if PARSE_EXECUTOR == "process" else ThreadPoolExecutor
+        self.parse_pool = pool(max_workers=PARSE_WORKERS)
+
+    async def parse(self, func, *args):
+        """parse_* 関数を解析用プールで実行する（重い HTML でもハートビートや他のタスクを止めない）"""
+        with self.monitor.span(f"parse:{func.__name__}"):
+            return await asyncio.get_running_loop().run_in_executor(self.parse_pool, func, *args)
+
+    def create_session(self):
+        """起動中ずっと使い回す aiohttp セッションを作る（TCP/TLS ハンドシェイクを毎回やり直さない）"""
+        trace = aiohttp.TraceConfig()
+        async def on_request_start(session, ctx, params):
+            self.http_stats["requests"] += 1
+            ctx.started = time.monotonic()
+        async def on_request_end(session, ctx, params):
+            self.record_upstream(params.url.host, ctx, params.response.status >= 400)
+        async def on_request_exception(session, ctx, params):
+            self.record_upstream(params.url.host, ctx, True)
+        async def on_connection_create_end(session, ctx, params): self.http_stats["connections"] += 1
+        async def on_connection_reuseconn(session, ctx, params): self.http_stats["reused"] += 1
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                                         keepalive_timeout=HTTP_KEEPALIVE_SEC, ttl_dns_cache=DNS_CACHE_SEC)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT, trace_configs=[trace])
+        return self.session
+
+    async def http_get(self, url, kind="page", headers=None, read="text", session=None):
+        """
+        上流への GET はすべてこれを通す（流量制限・取得先ごとのタイムアウト・再試行・ホストごとの遮断器）。
+        (status, 本文, ヘッダー) を返す。本文は 200 のときだけ read ("text" / "json" / "bytes") で読む。
+        遮断中なら送らずに UpstreamUnavailable、再試行しても駄目なら UpstreamError を投げる。
+        4xx (429 を除く) は上流が生きている証拠なので、失敗とは数えずにそのまま返す。
+        """
+        session = session or self.session
+        host = urlsplit(url).hostname or ""
+        breaker = self.breakers.get(host)
+        timeout = UPSTREAM_TIMEOUTS.get(kind, HTTP_TIMEOUT)
+        for attempt in range(UPSTREAM_RETRIES + 1):
+            if not breaker.allow(): raise UpstreamUnavailable(host, f"遮断中 (あと{breaker.retry_in():.0f}秒)")
+            await self.rate_limiter.acquire(url)
+            retry_after = None
+            try:
+                async with session.get(url, headers=headers, timeout=timeout) as resp:
+                    if resp.status < 500 and resp.status != 429:
+                        body = None
+                        if resp.status == 200:
+                            body = await (resp.json() if read == "json" else resp.read() if read == "bytes" else resp.text())
+                        breaker.success()
+                        return resp.status, body, resp.headers
+                    reason = f"HTTP {resp.status}"
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"), self.clock.time())
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                reason = f"{type(e).__name__} {e}".strip()
+            if retry_after is not None: retry_after = min(retry_after, BREAKER_MAX_OPEN_SEC)
+            breaker.failure(reason, retry_after)
+            # 遮断器が開いた・Retry-After が長いなど、すぐには戻らなさそうならここで諦める
+            delay = max(backoff_delay(attempt), breaker.retry_in())
+            if attempt == UPSTREAM_RETRIES or delay > UPSTREAM_BACKOFF_MAX_SEC: break
+            breaker.retries += 1
+            await asyncio.sleep(delay)
+        raise UpstreamError(host, reason)
+
+    def record_upstream(self, host, ctx, failed):
+        h = self.host_stats.setdefault(host, {"requests": 0, "errors": 0, "latency_sum": 0.0})
+        h["requests"] += 1
+        h["errors"] += failed
+        h["latency_sum"] += time.monotonic() - getattr(ctx, "started", time.monotonic())
+
+    # --- 死活確認・メトリクス ---
+    async def start_web_server(self):
+        """/ (死活確認) と /metrics (Prometheus 形式) を返すサーバーを bot のループ上で起動する"""
+        async def home(request): return web.Response(text="Bot is running!")
+        async def metrics(request):
+            return web.Response(text=self.render_metrics(), content_type="text/plain", charset="utf-8")
+        app = web.Application()
+        app.router.add_get("/", home)
+        app.router.add_get("/metrics", metrics)
+        if DEBUG_TRACE_TOKEN:
+            async def trace(request):
+                auth = request.headers.get("Authorization", "")
+                given = auth[len("Bearer "):] if auth.startswith("Bearer ") else request.query.get("token", "")
+                if not hmac.compare_digest(given.encode(), DEBUG_TRACE_TOKEN.encode()):
+                    return web.Response(status=403, text="forbidden")
+                return web.json_response(self.monitor.snapshot())
+            app.router.add_get("/debug/trace", trace)
+        self.web_runner = web.AppRunner(app, access_log=None)
+        await self.web_runner.setup()
+        await web.TCPSite(self.web_runner, WEB_HOST, WEB_PORT).start()
+
+    def render_metrics(self):
+        """現在の統計を Prometheus のテキスト形式にする"""
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP atcoder_bot_{name} {help_text}")
+            lines.append(f"# TYPE atcoder_bot_{name} {kind}")
+            for labels, value in samples:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"atcoder_bot_{name}{{{label}}} {value}" if label else f"atcoder_bot_{name} {value}")
+
+        metric("poll_cycle_seconds", "gauge", "Duration of the last submission poll cycle.",
+               [({}, self.poll_stats.get("elapsed", 0.0))])
+        metric("poll_cycle_seconds_total", "counter", "Total time spent in submission poll cycles.",
+               [({}, self.poll_totals["seconds"])])
+        metric("poll_cycles_total", "counter", "Submission poll cycles run.", [({}, self.poll_totals["cycles"])])
+        metric("poll_due_users", "gauge", "AtCoder IDs queried in the last poll cycle.",
+               [({}, self.poll_stats.get("due", 0))])
+        metric("poll_paused_total", "counter", "Poll cycles skipped while the kenkoooo circuit breaker was open.",
+               [({}, self.poll_totals["paused"])])
+
+        hosts = sorted(self.host_stats.items())
+        metric("upstream_requests_total", "counter", "HTTP requests to upstream hosts.",
+               [({"host": h}, v["requests"]) for h, v in hosts])
+        metric("upstream_errors_total", "counter", "Upstream requests that failed or returned >= 400.",
+               [({"host": h}, v["errors"]) for h, v in hosts])
+        metric("upstream_latency_seconds_total", "counter", "Total upstream request latency.",
+               [({"host": h}, v["latency_sum"]) for h, v in hosts])
+        breakers = sorted(self.breakers.by_host.items())
+        metric("upstream_breaker_state", "gauge", "Circuit breaker state (0=closed, 1=half-open, 2=open).",
+               [({"host": h}, BREAKER_STATES.index(b.state)) for h, b in breakers])
+        metric("upstream_breaker_trips_total", "counter", "Times the circuit breaker opened.",
+               [({"host": h}, b.trips) for h, b in breakers])
+        metric("upstream_rejected_total", "counter", "Requests not sent because the circuit breaker was open.",
+               [({"host": h}, b.rejected) for h, b in breakers])
+        metric("upstream_retries_total", "counter", "Upstream requests retried after a failure.",
+               [({"host": h}, b.retries) for h, b in breakers])
+
+        q = self.outbound.stats
+        metric("discord_sends_total", "counter", "Discord messages sent, by outcome.",
+               [({"result": r}, q[r]) for r in ("sent", "failed", "retried", "dropped")])
+        metric("discord_send_seconds_total", "counter", "Total time spent in Discord send calls.", [({}, q["send_sum"])])
+        metric("discord_queue_seconds_total", "counter", "Total time from enqueue to successful send.",
+               [({}, q["latency_sum"])])
+
+        metric("queue_depth", "gauge", "Items waiting in internal queues.", [
+            ({"queue": "outbound"}, self.outbound.depth()),
+            ({"queue": "ac_batch"}, sum(len(b["embeds"]) for b in self.ac_batcher.pending.values())),
+            ({"queue": "sheets_dirty"}, len(self.dirty_keys)),
+            ({"queue": "contest_notices"}, len(self.notice_heap)),
+        ])
+
+        c = self.status_cache.stats
+        metric("status_cache_hits_total", "counter", "/status profile cache hits within the TTL.", [({}, c["hits"])])
+        metric("status_cache_stale_hits_total", "counter", "/status profile cache hits served stale while revalidating.",
+               [({}, c["stale_hits"])])
+        metric("status_cache_misses_total", "counter", "/status profile cache misses.", [({}, c["misses"])])
+        metric("status_cache_refreshes_total", "counter", "Background revalidations started by stale hits.",
+               [({}, c["refreshes"])])
+        metric("status_cache_errors_total", "counter", "Profile fetches that failed or returned nothing.",
+               [({}, c["errors"])])
+        metric("status_cache_entries", "gauge", "Profiles held in the /status cache.", [({}, len(self.status_cache.entries))])
+
+        metric("sheets_writes_total", "counter", "Google Sheets write batches, by kind.",
+               [({"kind": k}, self.sheet_stats[k]) for k in ("rewrites", "patches", "failures")])
+        metric("sheets_rows_written_total", "counter", "Rows written to Google Sheets.", [({}, self.sheet_stats["rows"])])
+
+        lag = self.monitor.lag
+        metric("loop_lag_seconds", "gauge", "Event loop lag measured by the probe.",
+               [({"stat": "last"}, lag["last"]), ({"stat": "max"}, lag["max"])])
+        metric("loop_lag_seconds_total", "counter", "Sum of measured event loop lag.", [({}, lag["sum"])])
+        metric("loop_lag_probes_total", "counter", "Event loop lag probes run.", [({}, lag["count"])])
+        metric("slow_callbacks_total", "counter", "Callbacks that held the event loop longer than SLOW_CALLBACK_SEC.",
+               [({"task": t}, n) for t, n in sorted(self.monitor.slow_counts.items())])
+
+        metric("registrations", "gauge", "Registrations (guild, AtCoder ID).", [({}, len(self.registry))])
+        metric("registered_users", "gauge", "Distinct registered AtCoder IDs.", [({}, len(self.registry.by_atcoder))])
+        metric("news_channels", "gauge", "Guilds with a contest announcement channel.", [({}, len(self.news_config))])
+        return "\n".join(lines) + "\n"
+
+    def connect_sheets(self):
+        # gspread は同期通信なので別スレッドから呼ぶ
         try:
             scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
             creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
             self.gc = gspread.authorize(creds)
-            self.sheet = self.gc.open(SHEET_NAME)
-        except Exception as e: print(f"⚠️ Sheetsエラー: {e}")
+            return self.gc.open(SHEET_NAME)
+        except Exception as e:
+            print(f"⚠️ Sheetsエラー: {e}")
+            return None
             
     def get_rated_color(self, rated_str):
         if not rated_str or rated_str in ["-", "Unrated"]:
@@ -76,74 +1412,267 @@ class AtCoderBot(discord.Client):
                 
         return 0x808080 # デフォルト灰色
         
-    def save_to_sheets(self):
+    def user_row(self, v):
+        # Registration の中身を1行分のリストにする
+        return [
+            str(v.guild_id), 
+            v.atcoder_id, 
+            str(v.discord_user_id), 
+            str(v.channel_id), 
+            str(v.only_ac), 
+            str(v.last_sub_id),
+            str(v.last_epoch)
+        ]
+
+    def save_registration(self, key):
+        """登録の変更をローカルDBに書き、Sheets へのミラー待ちに積む"""
+        info = self.registry.get(key)
+        if info: self.store.save_registrations([info])
+        self.mark_dirty(key)
+
+    def remove_registration(self, key):
+        info = self.registry.remove(key)
+        if not info: return None
+        self.store.delete_registration(info.guild_id, info.atcoder_id)
+        self.mark_dirty(key, removed=True)
+        return info
+
+    def mark_dirty(self, key, removed=False):
+        """Sheets 未反映の変更を記録する。実際の書き込みは sheets_flusher がまとめて行う"""
+        if removed:
+            # 行の削除は行番号がずれるので、次回は全体を書き直す
+            self.sheet_rewrite = True
+            if self.sheet is None: self.removed_before_import.add(key)
+        else:
+            self.dirty_keys.add(key)
+
+    @tasks.loop(seconds=SHEETS_FLUSH_SEC)
+    async def sheets_flusher(self):
+        if self.sheet is None:
+            # 起動時に繋がらなかった場合はここで再接続を試みる（繋がるまでミラーは止まるだけ）
+            await self.start_sheets_mirror()
+        await self.flush_sheets()
+
+    async def start_sheets_mirror(self):
+        """
+        Sheets に接続する。旧バージョンからの移行 (cursors の sheets_imported) が済んでいなければ、
+        ローカルに無い登録を Sheets から取り込んでから書き込みを始める。
+        取り込みに失敗したときは self.sheet を設定しない（Sheets を書き直して登録を消さないため）。
+        """
+        sheet = await asyncio.to_thread(self.connect_sheets)
+        if sheet is None: return
+        if self.store.get_cursor("sheets_imported"):
+            # ローカルが正なので、次回の書き込みで Sheets 側をローカルに揃える
+            self.sheet = sheet
+            self.sheet_rewrite = True
+            return
+        loaded = await asyncio.to_thread(self.load_from_sheets, sheet)
+        if loaded is None: return
+        records, rows = loaded
+        missing = [info for key, info in records.items()
+                   if key not in self.registry and key not in self.removed_before_import]
+        for info in missing: self.registry.add(info)
+        self.store.save_registrations(missing)
+        self.store.set_cursor("sheets_imported", 1)
+        self.removed_before_import.clear()
+        # 接続前の登録・変更は dirty_keys に、削除は sheet_rewrite に残っているので次回の書き込みで反映される
+        self.sheet_rows = rows
+        self.sheet = sheet
+        print(f"📥 Sheets から {len(missing)} 件を取り込みました")
+
+    async def flush_sheets(self):
+        """溜まった変更を1回のバッチで Sheets に書く（gspread は同期なので別スレッドで実行）"""
+        if self.sheet is None or not (self.dirty_keys or self.sheet_rewrite): return
+        # 行データの組み立てはイベントループ側で行い、書き込み中の変更は次回に回す
+        dirty, rewrite = self.dirty_keys, self.sheet_rewrite
+        self.dirty_keys, self.sheet_rewrite = set(), False
         try:
-            ws_user = self.sheet.worksheet("users")
-            ws_user.clear()
-            # ヘッダーを書き込む
-            ws_user.append_row(["GuildID", "AtCoderID", "DiscordID", "ChannelID", "OnlyAC", "LastSubID"])
-            
-            rows = []
-            for key, v in self.user_data.items():
-                # self.user_data の中身を1行ずつリストにする
-                rows.append([
-                    str(v['guild_id']), 
-                    v['atcoder_id'], 
-                    str(v['discord_user_id']), 
-                    str(v['channel_id']), 
-                    str(v['only_ac']), 
-                    str(v.get('last_sub_id', 0))
-                ])
-            
-            if rows:
-                ws_user.append_rows(rows) # まとめてスプレッドシートへ
+            # 削除があったとき、または行番号が分からない（シートが空など）ときは全体を書き直す
+            if rewrite or not self.sheet_rows:
+                regs = list(self.registry)
+                with self.monitor.span("save_to_sheets"):
+                    await asyncio.to_thread(self.save_to_sheets, [self.user_row(v) for v in regs])
+                self.sheet_rows = {v.key: i + 2 for i, v in enumerate(regs)}
+                self.sheet_stats["rewrites"] += 1
+                self.sheet_stats["rows"] += len(regs)
+                return
+            updates, new_keys = [], []
+            for k in dirty:
+                if k not in self.registry: continue
+                if k in self.sheet_rows: updates.append((self.sheet_rows[k], self.user_row(self.registry.get(k))))
+                else: new_keys.append(k)
+            appends = [self.user_row(self.registry.get(k)) for k in new_keys]
+            with self.monitor.span("patch_sheets"):
+                await asyncio.to_thread(self.patch_sheets, updates, appends)
+            self.sheet_stats["patches"] += 1
+            self.sheet_stats["rows"] += len(updates) + len(appends)
+            first = max(self.sheet_rows.values(), default=1) + 1
+            for i, k in enumerate(new_keys):
+                self.sheet_rows[k] = first + i
         except Exception as e:
             print(f"❌ 書き込み失敗: {e}")
+            self.sheet_stats["failures"] += 1
+            # 失敗した分は次回にもう一度書く
+            self.dirty_keys |= dirty
+            self.sheet_rewrite |= rewrite
 
-    def load_from_sheets(self):
+    async def close(self):
+        # 終了前に未送信の通知と未反映の変更を書き出す
+        self.ac_batcher.flush()
+        await self.outbound.drain()
+        await self.flush_sheets()
+        if self.session: await self.session.close()
+        if self.web_runner: await self.web_runner.cleanup()
+        self.parse_pool.shutdown(wait=False)
+        await super().close()
+
+    def patch_sheets(self, updates, appends):
+        """変更された行だけを batch_update し、新しい行は末尾に追加する"""
+        ws_user = self.sheet.worksheet("users")
+        last_col = chr(ord('A') + len(USER_SHEET_HEADER) - 1)
+        if updates:
+            ws_user.batch_update([{"range": f"A{row}:{last_col}{row}", "values": [values]} for row, values in updates])
+        if appends:
+            ws_user.append_rows(appends)
+
+    def save_to_sheets(self, rows):
+        """users シートを全体書き直しする（削除があったときだけ使う）"""
+        ws_user = self.sheet.worksheet("users")
+        ws_user.clear()
+        # ヘッダーと全行を1回でまとめてスプレッドシートへ
+        ws_user.update(values=[USER_SHEET_HEADER] + rows, range_name="A1")
+
+    def load_from_sheets(self, sheet):
+        """users シートの登録と行番号を読む。読めなければ None"""
+        records, rows = {}, {}
         try:
-            ws_user = self.sheet.worksheet("users")
-            for r in ws_user.get_all_records():
+            ws_user = sheet.worksheet("users")
+            for i, r in enumerate(ws_user.get_all_records()):
                 # 「サーバーID_ユーザー名」で固有の鍵を作る
                 gid = str(r['GuildID'])
                 aid = r['AtCoderID']
                 key = f"{gid}_{aid}"
                 
-                self.user_data[key] = {
-                    "guild_id": int(gid),
-                    "atcoder_id": aid,
-                    "discord_user_id": int(r['DiscordID']),
-                    "channel_id": int(r['ChannelID']),
-                    "only_ac": str(r['OnlyAC']).lower() == 'true',
-                    "last_sub_id": int(r.get('LastSubID', 0))
-                }
+                records[key] = Registration(
+                    guild_id=int(gid),
+                    atcoder_id=aid,
+                    discord_user_id=int(r['DiscordID']),
+                    channel_id=int(r['ChannelID']),
+                    only_ac=str(r['OnlyAC']).lower() == 'true',
+                    last_sub_id=int(r.get('LastSubID', 0)),
+                    last_epoch=int(r.get('LastEpoch') or 0)
+                )
+                # ヘッダーが1行目なので、データは2行目から
+                rows[key] = i + 2
+        except gspread.exceptions.WorksheetNotFound:
+            pass  # 旧データが無い（取り込むものが無い）
         except Exception as e:
             print(f"❌ 読み込み失敗: {e}")
-            
+            return None
+        return records, rows
+
+    def load_local(self):
+        """ローカルDBから起動時の状態を読み込む"""
+        for info in self.store.load_registrations():
+            self.registry.add(info)
+        self.news_config = self.store.load_news_channels()
+        self.sent_notifications.load()
+        self.feed_cursor = self.store.get_cursor("feed")
+        for c_id, data in self.store.load_contests().items():
+            self.schedule_contest(c_id, data)
+
     async def setup_hook(self):
-        self.load_from_sheets()
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://kenkoooo.com/atcoder/resources/problems.json") as r:
-                    if r.status == 200: self.problems_map = {x['id']: x['title'] for x in await r.json()}
-                async with session.get("https://kenkoooo.com/atcoder/resources/problem-models.json") as r:
-                    if r.status == 200: self.diff_map = await r.json()
-        except: pass
+        # どのタスクがループを止めたか分かるよう、最初に計測を仕掛ける
+        if SLOW_CALLBACK_SEC > 0: self.monitor.install()
+        self.loop_probe_task = asyncio.create_task(self.monitor.probe(), name="loop_probe")
+        self.load_local()
+        # 死活確認用の HTTP サーバー（別スレッドは立てない）
+        await self.start_web_server()
+        # Sheets への接続・移行は起動を待たせずに裏で行う
+        self.sheets_flusher.start()
+        self.create_session()
+        # 問題一覧はまずディスクから読み、更新確認は裏で行う
+        await asyncio.to_thread(self.load_metadata_cache)
+        self.metadata_refresher.start()
         self.check_submissions.start()
-        # 既存の scheduler を開始（daily_schedule_update は scheduler 内で呼ばれます）
-        self.auto_contest_scheduler.start() 
+        # 予定表の定期確認と、予定時刻ちょうどに起きる通知タスク
+        self.contest_calendar_ingester.start()
+        self.contest_notifier_task = asyncio.create_task(self.run_contest_notifier(), name="contest_notifier")
         await self.tree.sync()
 
+    # --- 問題メタデータ (problems.json / problem-models.json) ---
+    def load_metadata_cache(self):
+        """前回保存したファイルを読み込む（起動直後からタイトル・難易度を出せるように）"""
+        try:
+            with open(os.path.join(CACHE_DIR, "metadata.json"), encoding="utf-8") as f:
+                self.metadata_validators = json.load(f)
+        except FileNotFoundError: pass
+        except Exception as e: print(f"⚠️ メタデータキャッシュ読み込み失敗: {e}")
+        for name in METADATA_URLS:
+            try:
+                with open(os.path.join(CACHE_DIR, f"{name}.json"), encoding="utf-8") as f:
+                    self.problems = self.problems.with_data(name, json.load(f))
+            except FileNotFoundError:
+                # 本体が無いのに検証子だけ残っていると 304 が返って永遠に取れないので捨てる
+                self.metadata_validators.pop(name, None)
+            except Exception as e:
+                self.metadata_validators.pop(name, None)
+                print(f"⚠️ メタデータキャッシュ読み込み失敗 ({name}): {e}")
+
+    def write_metadata_cache(self, name, body):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for fname, content in ((f"{name}.json", body), ("metadata.json", json.dumps(self.metadata_validators).encode())):
+            path = os.path.join(CACHE_DIR, fname)
+            with open(path + ".tmp", "wb") as f: f.write(content)
+            os.replace(path + ".tmp", path)
+
+    @traced
+    async def refresh_metadata(self):
+        """ETag / Last-Modified 付きの条件付き GET で、変わっていたときだけ取り直す"""
+        async with self.metadata_lock:
+            self.metadata_checked = self.clock.monotonic()
+            for name, url in METADATA_URLS.items():
+                v = self.metadata_validators.get(name, {})
+                headers = {}
+                if v.get("etag"): headers["If-None-Match"] = v["etag"]
+                if v.get("last_modified"): headers["If-Modified-Since"] = v["last_modified"]
+                try:
+                    status, body, resp_headers = await self.http_get(url, "metadata", headers=headers, read="bytes")
+                    if status == 304: continue
+                    if status != 200:
+                        print(f"⚠️ メタデータ取得失敗 ({name}): HTTP {status}")
+                        continue
+                    new_v = {"etag": resp_headers.get("ETag"), "last_modified": resp_headers.get("Last-Modified")}
+                    # 数MBのJSONなので、パース・カタログ作成・保存はイベントループの外で行う
+                    base = self.problems
+                    self.problems = await asyncio.to_thread(lambda: base.with_data(name, json.loads(body)))
+                    self.metadata_validators[name] = new_v
+                    await asyncio.to_thread(self.write_metadata_cache, name, body)
+                    print(f"📚 メタデータ更新: {name} ({len(body) // 1024}KB)")
+                except Exception as e:
+                    print(f"⚠️ メタデータ取得失敗 ({name}): {e}")
+
+    @tasks.loop(hours=METADATA_REFRESH_HOURS)
+    async def metadata_refresher(self):
+        await self.refresh_metadata()
+
+    async def ensure_problems_known(self, subs):
+        """起動後に追加された問題の提出を見たら、通知前に一度だけ問題一覧を取り直す"""
+        if all(sub['problem_id'] in self.problems for sub in subs): return
+        if self.metadata_lock.locked():
+            # 他で取得中ならそれを待つだけ
+            async with self.metadata_lock: return
+        if self.clock.monotonic() - self.metadata_checked >= METADATA_MIN_REFRESH_SEC:
+            await self.refresh_metadata()
+
     # --- AtCoderBotクラス内に追加 ---
     # --- AtCoderBotクラス内の既存のfetch_user_dataをこれに差し替え ---
+    @traced
     async def fetch_user_data(self, session, atcoder_id, mode='algo'):
         """
         AtCoderからユーザーデータを取得する。
         mode='algo' でアルゴリズム、mode='heur' でヒューリスティック用。
         """
-        import re
-        from bs4 import BeautifulSoup
-
         c_type = "heuristic" if mode == 'heur' else "algorithm"
         profile_url = f"https://atcoder.jp/users/{atcoder_id}?lang=ja&contestType={c_type}"
         history_url = f"https://atcoder.jp/users/{atcoder_id}/history/json?contestType={c_type}"
@@ -158,87 +1687,60 @@ class AtCoderBot(discord.Client):
 
         try:
             # 1. 履歴データ (JSON) の取得と解析
-            async with session.get(history_url, headers=headers, timeout=10) as resp:
-                if resp.status == 200:
-                    h_json = await resp.json()
-                    # Heuristicの場合はIsRated関係なく表示、AlgorithmはRatedのみを考慮
-                    rated_only = [h for h in h_json if h.get('IsRated') or mode == 'heur']
+            status, h_json, _ = await self.http_get(history_url, "history", headers=headers, read="json", session=session)
+            if status == 200:
+                # Heuristicの場合はIsRated関係なく表示、AlgorithmはRatedのみを考慮
+                rated_only = [h for h in h_json if h.get('IsRated') or mode == 'heur']
                     
-                    if rated_only:
-                        # 直近5件を逆順（新しい順）で取得
-                        latest_5 = rated_only[::-1][:5]
-                        for i, h in enumerate(latest_5):
-                            dt = datetime.fromisoformat(h['EndTime']).astimezone(JST)
-                            full_name = h.get('ContestName', 'Unknown')
-                            c_id = h.get('ContestScreenName', '').split('.')[0]
+                if rated_only:
+                    # 直近5件を逆順（新しい順）で取得
+                    latest_5 = rated_only[::-1][:5]
+                    for i, h in enumerate(latest_5):
+                        dt = datetime.fromisoformat(h['EndTime']).astimezone(JST)
+                        full_name = h.get('ContestName', 'Unknown')
+                        c_id = h.get('ContestScreenName', '').split('.')[0]
                             
-                            # --- 短縮名のロジック ---
-                            # "AtCoder Beginner Contest 441" から "ABC441" を作る
-                            m = re.search(r'AtCoder\s+(Beginner|Regular|Grand|Heuristic)\s+Contest\s+(\d+)', full_name, re.IGNORECASE)
-                            if m:
-                                type_char = m.group(1)[0].upper()  # B, R, G, H
-                                display_name = f"A{type_char}C{m.group(2)}"
-                                # AHC/ABCなどのIDを小文字で構成 (例: ahc001, abc300)
-                                contest_id_url = f"a{m.group(1)[0].lower()}c{m.group(2)}"
-                                short_name = f"[{display_name}](https://atcoder.jp/contests/{contest_id_url})"
-                            else:
-                                # 企業コンテスト等の場合
-                                display_name = (full_name[:12] + '..') if len(full_name) > 12 else full_name
-                                # 既に定義済みの c_id (ContestScreenNameから取得) を使用してリンク化
-                                short_name = f"[{display_name}](https://atcoder.jp/contests/{c_id})"
-
-                            data["history"].append({
-                                "name": short_name,
-                                "date": dt.strftime('%m/%d'),
-                                "perf": h.get('Performance', '---'),
-                                "rate": h.get('NewRating', '---'),
-                                "rank": h.get('Place', '---'),
-                                "url": f"https://atcoder.jp/contests/{c_id}/standings?watching={atcoder_id}"
-                            })
+                        # --- 短縮名のロジック ---
+                        # "AtCoder Beginner Contest 441" から "ABC441" を作る
+                        m = re.search(r'AtCoder\s+(Beginner|Regular|Grand|Heuristic)\s+Contest\s+(\d+)', full_name, re.IGNORECASE)
+                        if m:
+                            type_char = m.group(1)[0].upper()  # B, R, G, H
+                            display_name = f"A{type_char}C{m.group(2)}"
+                            # AHC/ABCなどのIDを小文字で構成 (例: ahc001, abc300)
+                            contest_id_url = f"a{m.group(1)[0].lower()}c{m.group(2)}"
+                            short_name = f"[{display_name}](https://atcoder.jp/contests/{contest_id_url})"
+                        else:
+                            # 企業コンテスト等の場合
+                            display_name = (full_name[:12] + '..') if len(full_name) > 12 else full_name
+                            # 既に定義済みの c_id (ContestScreenNameから取得) を使用してリンク化
+                            short_name = f"[{display_name}](https://atcoder.jp/contests/{c_id})"
+
+                        data["history"].append({
+                            "name": short_name,
+                            "date": dt.strftime('%m/%d'),
+                            "perf": h.get('Performance', '---'),
+                            "rate": h.get('NewRating', '---'),
+                            "rank": h.get('Place', '---'),
+                            "url": f"https://atcoder.jp/contests/{c_id}/standings?watching={atcoder_id}"
+                        })
                             
-                            # 一番新しいコンテスト (i=0) の情報を「現在のステータス」用に使用
-                            if i == 0:
-                                data["rating"] = h.get('NewRating', 0)
-                                data["last_date"] = dt.strftime('%Y/%m/%d')
-                                # ここは「フルネーム」をそのまま保持
-                                data["last_contest"] = full_name
-                                data["last_contest_url"] = f"https://atcoder.jp/contests/{c_id}"
+                        # 一番新しいコンテスト (i=0) の情報を「現在のステータス」用に使用
+                        if i == 0:
+                            data["rating"] = h.get('NewRating', 0)
+                            data["last_date"] = dt.strftime('%Y/%m/%d')
+                            # ここは「フルネーム」をそのまま保持
+                            data["last_contest"] = full_name
+                            data["last_contest_url"] = f"https://atcoder.jp/contests/{c_id}"
                                 
-                                # 前回比の計算
-                                if len(rated_only) >= 2:
-                                    change = h['NewRating'] - rated_only[-2]['NewRating']
-                                    data["diff"] = f"{'+' if change > 0 else ''}{change}"
+                            # 前回比の計算
+                            if len(rated_only) >= 2:
+                                change = h['NewRating'] - rated_only[-2]['NewRating']
+                                data["diff"] = f"{'+' if change > 0 else ''}{change}"
 
             # 2. プロフィールページ (HTML) の解析
-            async with session.get(profile_url, headers=headers, timeout=10) as resp:
-                if resp.status == 200:
-                    soup = BeautifulSoup(await resp.text(), 'html.parser')
-                    # ユーザー情報のテーブルを全スキャン
-                    for row in soup.find_all('tr'):
-                        th = row.find('th')
-                        td = row.find('td')
-                        if not th or not td: continue
-                        
-                        label = th.get_text(strip=True)
-                        val = td.get_text(" ", strip=True).replace('―', '').strip()
-                        
-                        # 各種項目のマッピング
-                        if label == "順位":
-                            data["rank_all"] = val
-                        elif "最高値" in label or "最高Rating" in label:
-                            parts = val.split()
-                            # Heuristic または 級が存在しない場合
-                            if mode == 'heur' or len(parts) == 1:
-                                data["max_rating"] = parts[0]
-                            else:
-                                # Algorithmかつ「級」が存在する場合
-                                data["max_rating"] = f"{parts[0]} ({' '.join(parts[1:])})"
-                        elif "参加回数" in label:
-                            data["contest_count"] = val
-                        elif "所属" in label:
-                            data["org"] = val
-                        elif "誕生年" in label:
-                            data["birth"] = val
+            status, page, _ = await self.http_get(profile_url, "page", headers=headers, session=session)
+            if status == 200:
+                data.update(await self.parse(parse_profile, page, mode))
 
             return data
         except Exception as e:
@@ -246,56 +1748,43 @@ class AtCoderBot(discord.Client):
             return None
 
     # --- 新規追加: 告知ページから詳細を抜く関数 ---
-    import html # ファイルの1行目付近に追加
-
+    @traced
     async def fetch_post_details(self, session, contest_id):
         post_url = f"https://atcoder.jp/posts/{contest_id}_ja"
         info = {"writer": "不明", "tester": "不明", "points": "未発表"}
         headers = {"User-Agent": "Mozilla/5.0"}
         
         try:
-            async with session.get(post_url, timeout=10, headers=headers) as resp:
-                if resp.status != 200: return info
-                raw_html = await resp.text()
-                
-                # 1. BeautifulSoupでデコードして、HTMLとしてパースする
-                import html, re
-                decoded_html = html.unescape(raw_html)
-                soup = BeautifulSoup(decoded_html, 'html.parser')
-                post_body = soup.find('div', class_='blog-post')
-                
-                if post_body:
-                    # 2. 【重要】タグの中の文字だけを抽出して繋げる
-                    # 画像などのリンクの中にある名前もこれで抽出される
-                    full_text = post_body.get_text("\n", strip=True)
-                    
-                    # 3. テキストからキーワードを探す
-                    lines = full_text.splitlines()
-                    for line in lines:
-                        clean_line = line.replace(':', '：').lstrip('- ').strip()
-                        
-                        if 'Writer' in clean_line and '：' in clean_line:
-                            info["writer"] = clean_line.split('：', 1)[-1].strip()
-                        elif 'Tester' in clean_line and '：' in clean_line:
-                            info["tester"] = clean_line.split('：', 1)[-1].strip()
-                        elif '配点' in clean_line and '：' in clean_line:
-                            info["points"] = clean_line.split('：', 1)[-1].strip()
-                            
-                    # --- バックアップ処理 ---
-                    # もしWriterが「不明」のままなら、行をまたいでいる可能性があるので、
-                    # テキスト全体からキーワードを探す
-                    if info["writer"] == "不明":
-                        if 'Writer：' in full_text:
-                            # 'Writer：' の後の文字を抽出して、次のキーワードまでを取る
-                            # (このコンテストの場合、Testerの手前まで)
-                            part = full_text.split('Writer：', 1)[-1]
-                            info["writer"] = part.split('Tester：', 1)[0].strip()
-
+            status, raw_html, _ = await self.http_get(post_url, "page", headers=headers, session=session)
+            if status != 200: return info
+            info = await self.parse(parse_post_details, raw_html)
         except Exception as e:
             print(f"❌ 詳細解析エラー: {e}")
             
         return info
 
+    async def get_post_details(self, contest_id):
+        """fetch_post_details の結果を TTL 付きで使い回す。同じIDの同時取得は1回にまとめる"""
+        hit = self.details_cache.get(contest_id)
+        if hit:
+            fetched_at, info = hit
+            ttl = DETAILS_UNKNOWN_TTL_SEC if info["writer"] == "不明" else DETAILS_CACHE_TTL_SEC
+            if self.clock.monotonic() - fetched_at < ttl: return info
+        task = self.details_inflight.get(contest_id)
+        if task is None:
+            task = self.details_inflight[contest_id] = asyncio.create_task(self.fetch_post_details(self.session, contest_id),
+                                                                                name=f"details:{contest_id}")
+            task.add_done_callback(lambda t: self.details_inflight.pop(contest_id, None))
+        info = await asyncio.shield(task)
+        self.details_cache[contest_id] = (self.clock.monotonic(), info)
+        return info
+
+    async def get_post_details_many(self, contest_ids):
+        """複数コンテストの詳細を、キャッシュに無いものだけ同時数を絞って並列に取る"""
+        sem = asyncio.Semaphore(DETAILS_FETCH_CONCURRENCY)
+        async def one(c_id):
+            async with sem: return await self.get_post_details(c_id)
+        return dict(zip(contest_ids, await asyncio.gather(*(one(c) for c in contest_ids))))
 
     def format_duration(self, dur_str):
         """'100分'や'01:40'を'1時間40分'に変換"""
@@ -320,45 +1809,84 @@ class AtCoderBot(discord.Client):
         except:
             return dur_str
 
-    # --- 新規追加: 毎日6:00に予定を読み取るタスク ---
-    @tasks.loop(hours=24)
-    async def daily_schedule_update(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://atcoder.jp/contests/?lang=ja") as resp:
-                if resp.status != 200: return
-                soup = BeautifulSoup(await resp.text(), 'html.parser')
-            
-            table = soup.find('div', id='contest-table-upcoming')
-            if not table: return
+    # --- コンテスト予定表の取り込み ---
+    def parse_calendar_row(self, row):
+        """parse_contest_table の1行を (コンテストID, 予約用の entry) にする"""
+        if row["duration"] is None or row["rated"] is None: return None
+        # 時刻解析
+        st_dt = datetime.strptime(row["time"], '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
+        # ID取得
+        c_id = row["href"].split('/')[-1]
+        dur_str = row["duration"]
+        entry = {
+            "name": row["name"],
+            "url": f"https://atcoder.jp/contests/{c_id}",
+            "start": st_dt,
+            "end": st_dt + timedelta(minutes=self.parse_duration(dur_str)),
+            "duration": dur_str,
+            "rated": row["rated"],
+        }
+        # 行の指紋（名前・時刻・時間・Rated のどれかが変われば変わる）
+        entry["fp"] = hashlib.sha1("|".join([entry["name"], st_dt.isoformat(), dur_str, entry["rated"]]).encode()).hexdigest()
+        return c_id, entry
 
-            now = datetime.now(JST)
-            for row in table.find_all('tr')[1:]:
-                cols = row.find_all('td')
-                if len(cols) < 4: continue
-                
-                # 時刻解析
-                time_str = cols[0].find('time').text
-                st_dt = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
-                
-                # ID取得
-                a_tag = cols[1].find('a')
-                c_id = a_tag['href'].split('/')[-1]
-                
-                # 24時間以内に開始されるコンテストのみ詳細を取得して予約
-                if 0 < (st_dt - now).total_seconds() <= 86400:
-                    details = await self.fetch_post_details(session, c_id)
-                    dur_str = cols[2].text.strip()
-                    # 予約リストに追加 (二重登録防止のため dict を使用)
-                    self.pending_contests[c_id] = {
-                        "name": a_tag.text.strip(),
-                        "url": f"https://atcoder.jp/contests/{c_id}",
-                        "start": st_dt,
-                        "end": st_dt + timedelta(minutes=self.parse_duration(dur_str)),
-                        "duration": dur_str,
-                        "rated": cols[3].text.strip(),
-                        "details": details,
-                        "sent": [] # 通知済みフラグを管理
-                    }
+    @tasks.loop(minutes=CALENDAR_REFRESH_MIN)
+    @traced
+    async def contest_calendar_ingester(self):
+        """
+        予定表を頻繁に確認し、変わったところだけ反映する。
+        表全体が前回と同じなら解析を省き、予約範囲に入ってきたコンテストだけ処理する。
+        告知ページは新しいコンテストか内容が変わったコンテストについてだけ取得する。
+        """
+        session = self.session
+        try:
+            status, html_text, _ = await self.http_get("https://atcoder.jp/contests/?lang=ja", "page", session=session)
+        except UpstreamError as e:
+            print(f"⚠️ 予定表を取得できません: {e}")
+            return
+        if status != 200: return
+
+        table = await self.parse(parse_contest_table, html_text, 'contest-table-upcoming', True)
+        if not table: return
+
+        fp = table["fp"]
+        if fp == self.calendar_fp:
+            rows = list(self.calendar_later.items())
+        else:
+            rows = []
+            for row in table["rows"]:
+                try: parsed = self.parse_calendar_row(row)
+                except Exception as e:
+                    print(f"⚠️ 予定表の行を解析できません: {e}")
+                    continue
+                if parsed: rows.append(parsed)
+            self.calendar_fp = fp
+
+        now = self.clock.now()
+        later = {}
+        for c_id, entry in rows:
+            pending = self.pending_contests.get(c_id)
+            if pending and pending.get('fp') == entry['fp']:
+                continue  # 変更なし
+            if not pending and not (0 < (entry['start'] - now).total_seconds() <= CALENDAR_HORIZON.total_seconds()):
+                # まだ先のコンテストは詳細を取らずに覚えておくだけ
+                later[c_id] = entry
+                continue
+            details = await self.get_post_details(c_id)
+            if pending and pending['start'] != entry['start']:
+                print(f"🔁 予定変更: {c_id} {pending['start']:%m/%d %H:%M} → {entry['start']:%m/%d %H:%M}")
+            # 予約リストに追加／時刻の変更を反映 (時刻が変わっていない送信済みの種類は schedule_contest が引き継ぐ)
+            self.schedule_contest(c_id, dict(entry, details=details, sent=[]))
+        self.calendar_later = later
+
+        # 告知ページが未公開・取得失敗で「不明」のままのコンテストは、開始までに取り直す
+        # （get_post_details が不明の結果を DETAILS_UNKNOWN_TTL_SEC だけ覚えるので、問い合わせはその間隔になる）
+        for c_id, pending in list(self.pending_contests.items()):
+            if pending['start'] <= now or pending.get('details', {}).get('writer') != "不明": continue
+            details = await self.get_post_details(c_id)
+            if details != pending['details']:
+                pending['details'] = details
+                self.store.save_contest(c_id, pending)
 
     # --- 新規追加: 時間文字列のパース用 ---
     def parse_duration(self, dur_str):
@@ -371,72 +1899,279 @@ class AtCoderBot(discord.Client):
         except: return 0
 
     
-    @tasks.loop(minutes=3)
+    def contest_running(self):
+        """予約済みの短時間コンテストのどれかが開催中なら True（長期コンテストは数えない）"""
+        now = self.clock.now()
+        return any(c['start'] <= now <= c['end'] and c['end'] - c['start'] <= POLL_CONTEST_MAX_DURATION
+                   for c in self.pending_contests.values())
+
+    def next_poll_interval(self, infos, prev, active):
+        """
+        次の問い合わせまでの間隔。新しい提出があれば最短、無ければ前回の倍 (上限あり)。
+        再起動直後など前回の間隔が無いときは最後の提出からの経過時間で決める。
+        """
+        if active: return POLL_MIN_INTERVAL_SEC
+        idle = self.clock.time() - max((info.last_epoch for info in infos), default=0)
+        by_idle = idle / POLL_IDLE_RATIO
+        interval = max(prev * 2, by_idle) if prev else by_idle
+        return min(POLL_MAX_INTERVAL_SEC, max(POLL_MIN_INTERVAL_SEC, interval))
+
+    def poll_order(self, groups, now, contest):
+        """
+        期限が来た AtCoder ID を、POLL_ACTIVE_SEC 以内に提出があったもの → 期限を過ぎている順 に並べて返す。
+        流量制限で周回に収まらなかった ID は次の周回で先頭近くに来るので、同じ ID ばかり問い合わせることはない。
+        """
+        recent = self.clock.time() - POLL_ACTIVE_SEC
+        order = []
+        for atcoder_id, keys in groups.items():
+            due, interval = self.poll_schedule.get(atcoder_id, (0.0, 0))
+            if contest: due = min(due, due - interval + POLL_CONTEST_INTERVAL_SEC)
+            if due > now: continue
+            # 最後に見えた提出の時刻（カーソル）を最近の活動の目安にする
+            last_seen = max((r.queued_epoch for r in map(self.registry.get, keys) if r), default=0)
+            order.append((last_seen < recent, due, atcoder_id))
+        return [atcoder_id for _, _, atcoder_id in sorted(order)]
+
+    @tasks.loop(seconds=POLL_TICK_SEC)
+    @traced
     async def check_submissions(self):
-        # セッションをループの外で作成（効率化）
-        async with aiohttp.ClientSession() as session:
-            # 辞書のコピーに対してループを回す（実行中のサイズ変更エラー防止）
-            for key in list(self.user_data.keys()):
-                info = self.user_data[key]
+        started = time.monotonic()
+        # 問い合わせ予定の判断は時計の時刻で行う（所要時間の計測は実時間のまま）
+        now = self.clock.monotonic()
+        # kenkoooo の遮断中は休む。予定とカーソルはそのままなので、再開時は期限切れの ID から続きを読む
+        host = urlsplit(KENKOOOO_API).hostname
+        if not self.breakers.available(host):
+            self.poll_totals["paused"] += 1
+            print(f"⏸️ 提出チェック休止: {host} 遮断中 (あと{self.breakers.get(host).retry_in():.0f}秒)")
+            return
+        # 同じ AtCoder ID の登録をまとめ、IDごとに1回だけ問い合わせる
+        # （索引のコピーから作るので実行中のサイズ変更エラーも起きない）
+        groups = {aid: list(regs) for aid, regs in self.registry.by_atcoder.items()}
+        total = len(groups)
+        # 登録が消えた ID の予定は捨てる
+        for aid in [aid for aid in self.poll_schedule if aid not in groups]:
+            del self.poll_schedule[aid]
+        # コンテスト中は全員を短い間隔で見る
+        contest = self.contest_running()
+        requests_before = sum(self.rate_limiter.counts.values())
+        queue = asyncio.Queue()
+        if INGEST_MODE != "feed":
+            for atcoder_id in self.poll_order(groups, now, contest):
+                queue.put_nowait(atcoder_id)
+        due_count = queue.qsize()
+
+        async def worker(session):
+            while True:
+                try: atcoder_id = queue.get_nowait()
+                except asyncio.QueueEmpty: return
+                # 周回中に削除された登録は除く
+                infos = [self.registry.get(k) for k in groups[atcoder_id] if k in self.registry]
+                if not infos: continue
+                active = False
                 try:
-                    await self.process_submissions(session, info, lookback_seconds=259200)
+                    active = await self.process_submissions(session, atcoder_id, infos, lookback_seconds=259200)
+                except UpstreamUnavailable:
+                    # 遮断された: 残りは予定を据え置いて次の周回に回す
+                    return
+                except UpstreamError as e:
+                    # 取れなかった ID は予定を据え置き、次の周回でもう一度問い合わせる
+                    print(f"⚠️ 提出確認エラー ({atcoder_id}): {e}")
+                    continue
                 except Exception as e:
-                    print(f"⚠️ 提出確認エラー ({key}): {e}")
+                    print(f"⚠️ 提出確認エラー ({atcoder_id}): {e}")
+                prev = self.poll_schedule.get(atcoder_id, (0.0, 0))[1]
+                interval = self.next_poll_interval(infos, prev, active)
+                self.poll_schedule[atcoder_id] = [self.clock.monotonic() + interval, interval]
 
-    async def process_submissions(self, session, info, lookback_seconds):
-        atcoder_id = info['atcoder_id']
-        guild_id = info['guild_id']
-        key = f"{guild_id}_{atcoder_id}"
-        
-        # 過去の保存データから最後に通知したIDを取得
-        last_id = int(info.get('last_sub_id', 0))
-        
-        # 2日分（172800秒）遡って取得するようにURLを作成
-        # 引数の lookback_seconds が 172800 (2日) であることを想定
-        url = f"https://kenkoooo.com/atcoder/atcoder-api/v3/user/submissions?user={atcoder_id}&from_second={int(datetime.now().timestamp() - lookback_seconds)}"
+        # 起動中ずっと使い回す共有セッション（接続は keep-alive で再利用される）
+        session = self.session
+        conns_before = self.http_stats["connections"]
+        if INGEST_MODE == "feed":
+            # フィードは1回で全員分なので ID ごとの間隔は使わず、コンテスト中だけ短くする
+            workers = 1
+            due_count = total if self.feed_due <= now or contest else 0
+            if due_count:
+                self.feed_due = now + POLL_INTERVAL_MIN * 60
+                try:
+                    await self.poll_recent_feed(session, groups)
+                except UpstreamError as e:
+                    # 読めなかった分は次の周回で保存済みのカーソルから読み直す
+                    self.feed_due = now
+                    print(f"⚠️ 新着フィード確認エラー: {e}")
+                except Exception as e:
+                    print(f"⚠️ 新着フィード確認エラー: {e}")
+        else:
+            workers = min(POLL_WORKERS, due_count)
+            await asyncio.gather(*(worker(session) for _ in range(workers)))
+        if not due_count: return
+
+        # 1周にかかった時間をループ周期と比べて報告
+        elapsed = time.monotonic() - started
+        interval = POLL_TICK_SEC
+        self.poll_totals["cycles"] += 1
+        self.poll_totals["seconds"] += elapsed
+        self.poll_stats = {"users": total, "due": due_count, "registrations": sum(map(len, groups.values())),
+                           "workers": workers, "elapsed": elapsed, "mode": INGEST_MODE, "contest": contest,
+                           "requests": sum(self.rate_limiter.counts.values()) - requests_before,
+                           "new_connections": self.http_stats["connections"] - conns_before,
+                           "interval": interval, "ratio": elapsed / interval}
+        mark = "⚠️" if elapsed > interval else "⏱️"
+        print(f"{mark} 提出チェック: {elapsed:.1f}s / {interval}s ({due_count}/{total}件, {workers}並列, "
+              f"新規接続 {self.poll_stats['new_connections']}{', コンテスト中' if contest else ''})")
+
+    async def fetch_submissions(self, session, atcoder_id, from_second):
+        """kenkoooo から from_second 以降の提出を取得し、古い順（ID昇順）で返す"""
+        url = f"{KENKOOOO_API}/user/submissions?user={atcoder_id}&from_second={from_second}"
+        status, subs, _ = await self.http_get(url, "submissions", read="json", session=session)
+        if status != 200: return None
+        return sorted(subs, key=lambda x: x['id']) if subs else []
+
+    async def poll_recent_feed(self, session, groups):
+        """
+        全ユーザーの新着提出を feed_cursor から読み、登録済みの AtCoder ID 分だけ配る。
+        groups は check_submissions で作った {atcoder_id: [登録の鍵]}。
+        登録者数に関係なく、1周あたりのリクエストは (新着件数 / 1000) 回で済む。
+        """
+        # kenkoooo 側の user_id と大文字小文字が違っても拾えるようにする
+        registered = {aid.lower(): aid for aid in groups}
+        cursor = self.feed_cursor or int(self.clock.time()) - FEED_INITIAL_LOOKBACK
+        # 送れなかった提出があれば、その時刻まで戻って読み直す
+        retry, self.feed_retry_epoch = self.feed_retry_epoch, None
+        from_second = min(cursor, retry or cursor) - CURSOR_OVERLAP_SEC
+        matched = {}
+        # 途中のページで上流が落ちたら、読めたところまで配ってカーソルを進めてから投げ直す
+        failed = None
+
+        for _ in range(FEED_MAX_PAGES):
+            url = f"{KENKOOOO_API}/from/{from_second}"
+            try:
+                status, subs, _ = await self.http_get(url, "feed", read="json", session=session)
+            except UpstreamError as e:
+                failed = e
+                break
+            if status != 200 or not subs: break
+            for sub in subs:
+                aid = registered.get(sub['user_id'].lower())
+                if aid: matched.setdefault(aid, {})[sub['id']] = sub
+            page_last = max(x['epoch_second'] for x in subs)
+            cursor = max(cursor, page_last)
+            if len(subs) < FEED_PAGE_SIZE: break
+            # 同一秒の提出が1000件を超えても先へ進めるようにする
+            from_second = max(from_second + 1, page_last)
+
+        for aid, subs in matched.items():
+            sorted_subs = sorted(subs.values(), key=lambda x: x['id'])
+            await self.ensure_problems_known(sorted_subs)
+            for key in [k for k in groups[aid] if k in self.registry]:
+                try:
+                    await self.deliver_submissions(self.registry.get(key), sorted_subs)
+                except Exception as e:
+                    print(f"⚠️ 通知エラー ({key}): {e}")
+        if failed and retry: self.feed_retry_epoch = min(retry, self.feed_retry_epoch or retry)
+        if cursor != self.feed_cursor:
+            self.feed_cursor = cursor
+            # 保存するのは送信待ちの提出より手前まで（落ちても再起動後に読み直せるように）
+            waiting = [min(info.inflight.values()) for info in self.registry if info.inflight]
+            self.store.set_cursor("feed", min([cursor] + waiting))
+        if failed: raise failed
+
+    async def process_submissions(self, session, atcoder_id, infos, lookback_seconds):
+        """
+        同じ AtCoder ID を登録している全サーバー分 (infos) をまとめて処理する。
+        取得は1回だけで、last_sub_id と only_ac は登録ごとに判定する。
+        lookback_seconds はカーソル未保存の登録（登録直後など）だけに使う。
+        どれかの登録で新しい提出が見つかれば True を返す（問い合わせ間隔の調整に使う）。
+        """
+        # 各登録のカーソルから少し遡った位置のうち、最も古いところから取得する
+        now_ts = int(self.clock.time())
+        from_second = min(
+            info.last_epoch - CURSOR_OVERLAP_SEC if info.last_epoch else now_ts - lookback_seconds
+            for info in infos
+        )
         
+        active = False
         try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    subs = await resp.json()
-                    if not subs:
-                        return
-
-                    new_last_id = last_id
-                    # 提出を古い順（ID昇順）に並べる
-                    sorted_subs = sorted(subs, key=lambda x: x['id'])
-
-                    for sub in sorted_subs:
-                        # 既に通知済みのIDなら飛ばす（2回目以降のループ用）
-                        if last_id != 0 and sub['id'] <= last_id:
-                            continue
-                        
-                        # ACのみ通知の設定なら、AC以外を飛ばす
-                        if info.get('only_ac', True) and sub['result'] != 'AC':
-                            new_last_id = max(new_last_id, sub['id'])
-                            continue
-                        
-                        # 通知送信！
-                        # (登録直後なら、ここで過去2日分の通知が連続で飛びます)
-                        await self.send_ac_notification(info, sub)
-                        
-                        # 通知した中で最新のIDを保持
-                        new_last_id = max(new_last_id, sub['id'])
-                    
-                    # 最後にまとめて「どこまで通知したか」を保存
-                    if new_last_id > last_id:
-                        self.user_data[key]['last_sub_id'] = new_last_id
-                        self.save_to_sheets()
+            sorted_subs = await self.fetch_submissions(session, atcoder_id, from_second)
+            if not sorted_subs:
+                return False
+            await self.ensure_problems_known(sorted_subs)
+
+            for info in infos:
+                key = info.key
+                try:
+                    # カーソルの保存は deliver_submissions と送信完了時に行う
+                    if await self.deliver_submissions(info, sorted_subs):
+                        active = True
+                except Exception as e:
+                    print(f"⚠️ 通知エラー ({key}): {e}")
+        except UpstreamError:
+            raise
         except Exception as e:
-            print(f"⚠️ process_submissions エラー ({key}): {e}")
+            print(f"⚠️ process_submissions エラー ({atcoder_id}): {e}")
+        return active
+
+    async def deliver_submissions(self, info, sorted_subs):
+        """
+        1件の登録に対して未通知の提出を送信キューへ積む。新しい提出を処理したら True。
+        カーソル (last_sub_id / last_epoch) は送信が終わった分までしか進めず、送れなかった提出は次の周回で送り直す。
+        積んだがまだ送れていない分は queued_sub_id で覚えておき、次の周回で二重に積まない。
+        """
+        queued_id, queued_epoch = info.queued_sub_id, info.queued_epoch
+        new_id = queued_id
+
+        for sub in sorted_subs:
+            # 既に積んだ (通知済みの) IDなら飛ばす
+            if queued_id != 0 and sub['id'] <= queued_id:
+                continue
+            
+            # ACのみ通知の設定なら、AC以外は見ただけで済ませる
+            # (登録直後なら、ここで過去2日分の通知が連続で飛びます)
+            if not (info.only_ac and sub['result'] != 'AC'):
+                sent = await self.send_ac_notification(info, sub)
+                if sent is not None:
+                    info.inflight[sub['id']] = sub['epoch_second']
+                    sent.add_done_callback(functools.partial(self.ac_sent, info, sub['id']))
+            new_id = max(new_id, sub['id'])
+        
+        # 見えた提出のうち最新の時刻を次回の from_second にする
+        info.queued_sub_id = new_id
+        info.queued_epoch = max(queued_epoch, max(x['epoch_second'] for x in sorted_subs))
+        self.commit_cursor(info)
+        return new_id > queued_id or info.queued_epoch > queued_epoch
+
+    def ac_sent(self, info, sub_id, sent):
+        """
+        提出通知の送信結果を受けてカーソルを進める。
+        再試行しても失敗・キュー溢れで捨てられたものは、積んだ位置を手前に戻して次の周回で送り直す。
+        チャンネルが消えた・権限がない (Forbidden / NotFound) ものは送り直しても同じなので済んだ扱いにする。
+        """
+        epoch = info.inflight.pop(sub_id, None)
+        if epoch is None: return
+        error = None if sent.cancelled() else sent.exception()
+        if sent.cancelled() or (error and not isinstance(error, (discord.Forbidden, discord.NotFound))):
+            info.queued_sub_id = min(info.queued_sub_id, sub_id - 1)
+            info.queued_epoch = min(info.queued_epoch, epoch)
+            self.feed_retry_epoch = min(epoch, self.feed_retry_epoch or epoch)
+        if self.registry.get(info.key) is info: self.commit_cursor(info)
+
+    def commit_cursor(self, info):
+        """送信待ちより手前までカーソルを進め、進んだらローカルDB・Sheets に書く"""
+        sub_id, epoch = info.queued_sub_id, info.queued_epoch
+        if info.inflight:
+            sub_id = min(sub_id, min(info.inflight) - 1)
+            epoch = min(epoch, min(info.inflight.values()))
+        if sub_id > info.last_sub_id or epoch > info.last_epoch:
+            info.last_sub_id = max(info.last_sub_id, sub_id)
+            info.last_epoch = max(info.last_epoch, epoch)
+            self.save_registration(info.key)
             
     async def send_ac_notification(self, info, sub):
-        channel = self.get_channel(info['channel_id'])
+        channel = self.get_channel(info.channel_id)
         if not channel: return
-        prob_id, atcoder_id = sub['problem_id'], info['atcoder_id']
-        prob_title = self.problems_map.get(prob_id, prob_id)
-        difficulty = self.diff_map.get(prob_id, {}).get('difficulty')
-        user = self.get_user(info['discord_user_id'])
+        prob_id, atcoder_id = sub['problem_id'], info.atcoder_id
+        prob_title = self.problems.title(prob_id, prob_id)
+        difficulty = self.problems.difficulty(prob_id)
+        user = self.get_user(info.discord_user_id)
         user_name = user.display_name if user else "Unknown"
         user_icon = user.display_avatar.url if user else None
         res = sub['result']
@@ -458,57 +2193,63 @@ class AtCoderBot(discord.Client):
         embed.description = desc
         dt = datetime.fromtimestamp(sub['epoch_second'], JST)
         embed.set_footer(text=f"提出時刻 : {dt.strftime('%b %d, %Y (%a) %H:%M:%S')}")
-        await channel.send(embed=embed)
+        # 連続した通知はチャンネルごとにまとめて送る（送信結果の Future を返す）
+        return self.ac_batcher.add(channel, embed)
 
+    @traced
     async def fetch_recent_announcements(self, session):
         results = {}
         try:
             # 日本語ページを強制
-            async with session.get("https://atcoder.jp/home?lang=ja") as resp:
-                soup = BeautifulSoup(await resp.text(), 'html.parser')
-            
-            for post in soup.find_all('div', class_='panel-default'):
-                body = post.find('div', class_='panel-body blog-post')
-                if not body: continue
-                
-                # コンテストURLの取得と正規化
-                link_tag = body.find('a', href=re.compile(r'https://atcoder\.jp/contests/[^" \n]+'))
-                if not link_tag: continue
-                c_url = link_tag['href'].split('?')[0].rstrip('/')
-                
-                info = {"writer": "不明", "tester": "不明", "points": "未発表"}
-
-                # 名前を抽出する専用ロジック (aタグの中身を拾う)
-                def extract_users(keyword):
-                    target = body.find(string=re.compile(keyword))
-                    if not target: return None
-                    # キーワードの親要素から /users/ リンクを持つaタグをすべて取得
-                    links = target.parent.find_all('a', href=re.compile(r'/users/'))
-                    return ", ".join([u.get_text(strip=True) for u in links]) if links else None
-
-                info["writer"] = extract_users("Writer") or "不明"
-                info["tester"] = extract_users("Tester") or "不明"
-
-                # 配点のパース (テキストから取得)
-                content_text = body.get_text("|", strip=True)
-                for line in content_text.split("|"):
-                    if "配点：" in line or "配点:" in line:
-                        info["points"] = line.split("：")[-1].split(":")[-1].strip()
-                
-                results[c_url] = info
+            status, page, _ = await self.http_get("https://atcoder.jp/home?lang=ja", "page", session=session)
+            if status != 200: return results
+            results = await self.parse(parse_home_announcements, page)
         except Exception as e:
             print(f"⚠️ 告知解析エラー: {e}")
         return results
         
-    async def broadcast_contest(self, name, url, st, dur, rated, label, details, is_10min=False, is_start=False, is_end=False):
-        # 終了通知(cend)の場合もユニークキーを作って二重送信防止
-        key = f"{label}_{url}"
+    @traced
+    async def broadcast_contest(self, name, url, st, dur, rated, label, details, is_start=False, kind=None):
+        # 「コンテストID:種類」で二重送信防止（種類の指定がなければラベルを使う）
+        key = SentNotices.key(url.rstrip('/').split('/')[-1], kind or label)
         if key in self.sent_notifications: return
         self.sent_notifications.add(key)
-        embed = self.create_contest_embed(name, url, st, dur, rated, details, is_10min, is_start, is_end)
+        # Embed は1回だけ作って全チャンネルで使い回す
+        embed = self.create_contest_embed(name, url, st, dur, rated, details, is_start=is_start)
+        started = self.clock.monotonic()
+        futs, failures = {}, {}
         for cid in self.news_config.values():
             channel = self.get_channel(cid)
-            if channel: await channel.send(content=f"**{label}**", embed=embed)
+            if not channel:
+                failures[cid] = "チャンネルが見つかりません"
+                continue
+            # 各チャンネルへの送信は送信キューのワーカーが並列に行う（同時数は SEND_CONCURRENCY まで）
+            futs[cid] = self.outbound.submit(cid, PRIORITY_CONTEST,
+                                             lambda channel=channel: channel.send(content=f"**{label}**", embed=embed))
+        task = asyncio.create_task(self.report_broadcast(f"{label} {name}", started, futs, failures), name="report_broadcast")
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def report_broadcast(self, title, started, futs, failures):
+        """全チャンネルへの配信が終わるのを待ち、最初と最後の到達時刻の差と失敗したチャンネルを記録する"""
+        delivered, total = [], len(futs) + len(failures)
+        async def wait_one(cid, fut):
+            try:
+                await fut
+                delivered.append(self.clock.monotonic())
+            except Exception as e:
+                # 1チャンネルの失敗で他を止めない
+                failures[cid] = f"{type(e).__name__}: {e}"
+        await asyncio.gather(*(wait_one(cid, f) for cid, f in futs.items()))
+        self.broadcast_stats = {
+            "title": title, "channels": total,
+            "delivered": len(delivered), "failures": failures,
+            "first_sec": min(delivered) - started if delivered else None,
+            "spread_sec": max(delivered) - min(delivered) if delivered else None,
+        }
+        spread = self.broadcast_stats["spread_sec"]
+        print(f"📣 {title}: {len(delivered)}件配信 / 失敗 {len(failures)}件"
+              + (f" / 最初〜最後 {spread:.2f}s" if spread is not None else ""))
                 
     def create_status_embed(self, d, target):
         mode_label = "Algorithm" if d['mode'] == 'algo' else "Heuristic"
@@ -570,91 +2311,128 @@ class AtCoderBot(discord.Client):
         return embed
         
     async def check_immediate_announcement(self, channel_id):
-        now = datetime.now(JST)
+        now = self.clock.now()
         channel = self.get_channel(channel_id)
         if not channel: return
         
-        status_msg = await channel.send(f"⏳ 最終デプロイ確認中... ({now.strftime('%H:%M:%S')})")
-        async with aiohttp.ClientSession() as session:
-            recent_details = await self.fetch_recent_announcements(session)
+        status_msg = await self.outbound.submit(
+            channel_id, PRIORITY_COMMAND, lambda: channel.send(f"⏳ 最終デプロイ確認中... ({now.strftime('%H:%M:%S')})"))
+        session = self.session
+        recent_details = await self.fetch_recent_announcements(session)
             
-            async with session.get("https://atcoder.jp/home?lang=ja") as resp:
-                soup = BeautifulSoup(await resp.text(), 'html.parser')
-                # 予定テーブル
-                table = soup.find('div', id='contest-table-upcoming')
-                if not table: return
-
-                rows = table.find_all('tr')[1:]
-                log_txt = "📊 **最終解析結果**\n```\n"
-                found_any = False
-
-                for row in rows:
-                    cols = row.find_all('td')
-                    if len(cols) < 2: continue
-                    
-                    time_tag = row.find('time')
-                    a_tag = cols[1].find('a')
-                    if not time_tag or not a_tag: continue
-
-                    c_url = "[https://atcoder.jp](https://atcoder.jp)" + a_tag['href'].split('?')[0].rstrip('/')
-                    c_name = a_tag.text.strip()
-                    
-                    try:
-                        st_dt = datetime.strptime(time_tag.text.strip(), '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
-                        diff = int((st_dt - now).total_seconds() / 60)
+        try:
+            status, page, _ = await self.http_get("https://atcoder.jp/home?lang=ja", "page", session=session)
+        except UpstreamError as e:
+            status, page = str(e), None
+        if page is None:
+            failure = f"❌ AtCoder のページを取得できませんでした ({status})"
+            self.outbound.submit(channel_id, PRIORITY_COMMAND, lambda: status_msg.edit(content=failure))
+            return
+        # 予定テーブル
+        table = await self.parse(parse_contest_table, page, 'contest-table-upcoming')
+        if not table: return
 
-                        if 0 < diff <= 1440:
-                            # 取得した本質データと合体
-                            info = recent_details.get(c_url, {"writer":"確認中","tester":"確認中","points":"確認中"})
-                            
-                            # Embed送信で失敗してもループを止めないガード
-                            try:
-                                # 列の存在チェックを厳密に
-                                duration = cols[2].text.strip() if len(cols) > 2 else "不明"
-                                rated = cols[3].text.strip() if len(cols) > 3 else "不明"
-                                
-                                await self.broadcast_contest(c_name, c_url, st_dt, duration, rated, "⏰ 本日開催", info)
-                                log_txt += f"・{c_name[:12]} | ✅ 送信成功\n"
-                                found_any = True
-                            except Exception as discord_e:
-                                log_txt += f"・{c_name[:12]} | ❌ 400エラー: {str(discord_e)[:10]}\n"
-                        else:
-                            log_txt += f"・{c_name[:12]} | {diff}分前\n"
-                    except: continue
+        log_txt = "📊 **最終解析結果**\n```\n"
+        found_any = False
 
-                log_txt += "```"
-                await status_msg.edit(content=log_txt)
+        for row in table["rows"]:
+            c_url = "https://atcoder.jp" + row["href"].split('?')[0].rstrip('/')
+            c_name = row["name"]
                 
-    @tasks.loop(minutes=1)
-    async def auto_contest_scheduler(self):
-        now = datetime.now(JST)
-        # 毎日6:00にリストを更新する（初回や時間のズレ対策）
-        if now.hour == 6 and now.minute == 0:
-            await self.daily_schedule_update()
+            try:
+                st_dt = datetime.strptime(row["time"], '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
+                diff = int((st_dt - now).total_seconds() / 60)
+
+                if 0 < diff <= 1440:
+                    # 取得した本質データと合体
+                    info = recent_details.get(c_url, {"writer":"確認中","tester":"確認中","points":"確認中"})
+                        
+                    # Embed送信で失敗してもループを止めないガード
+                    try:
+                        # 列の存在チェックを厳密に
+                        duration = row["duration"] or "不明"
+                        rated = row["rated"] or "不明"
+                            
+                        await self.broadcast_contest(c_name, c_url, st_dt, duration, rated, "⏰ 本日開催", info, kind="today")
+                        log_txt += f"・{c_name[:12]} | ✅ 送信成功\n"
+                        found_any = True
+                    except Exception as discord_e:
+                        log_txt += f"・{c_name[:12]} | ❌ 400エラー: {str(discord_e)[:10]}\n"
+                else:
+                    log_txt += f"・{c_name[:12]} | {diff}分前\n"
+            except: continue
 
-        for c_id, data in list(self.pending_contests.items()):
-            diff_st = (data['start'] - now).total_seconds() / 60
-            diff_en = (data['end'] - now).total_seconds() / 60
+        log_txt += "```"
+        self.outbound.submit(channel_id, PRIORITY_COMMAND, lambda: status_msg.edit(content=log_txt))
             
-            # 通知判定 (sentリストに入れて二重送信を防止)
-            # 24時間前
-            if 1439 <= diff_st <= 1440 and "24h" not in data['sent']:
-                await self.broadcast_contest(data['name'], data['url'], data['start'], data['duration'], data['rated'], "⏰ 24時間前", data['details'])
-                data['sent'].append("24h")
-            # 15分前
-            elif 14 <= diff_st <= 15 and "15m" not in data['sent']:
-                await self.broadcast_contest(data['name'], data['url'], data['start'], data['duration'], data['rated'], "⚠️ 15分前", data['details'])
-                data['sent'].append("15m")
-            # 開始
-            elif -1 <= diff_st <= 0 and "start" not in data['sent']:
-                await self.broadcast_contest(data['name'], data['url'], data['start'], data['duration'], data['rated'], "🚀 開始！", data['details'], is_start=True)
-                data['sent'].append("start")
-            # 終了
-            elif -1 <= diff_en <= 0 and "end" not in data['sent']:
-                await self.broadcast_contest(data['name'], data['url'], data['start'], data['duration'], data['rated'], "🏁 終了！", data['details'])
-                data['sent'].append("end")
-                # 終了したコンテストはリストから削除
-                del self.pending_contests[c_id]
+    # --- コンテスト通知スケジューラ ---
+    def schedule_contest(self, c_id, data):
+        """
+        コンテストを予約リストに入れ、未送信の通知をヒープに積む。
+        同じコンテストを入れ直した場合は送信済みの種類を引き継ぎ、古いヒープ要素は発火時に捨てる。
+        ただし基準の時刻 (開始・終了) が変わった種類は、新しい時刻で送り直すので送信済みから外す。
+        """
+        if self.clock.time() - data['end'].timestamp() > NOTICE_GRACE_SEC:
+            # 停止中に終わってしまったコンテストは捨てる
+            self.pending_contests.pop(c_id, None)
+            self.store.delete_contest(c_id)
+            return
+        old = self.pending_contests.get(c_id)
+        if old:
+            moved = {kind for kind, anchor, _, _ in CONTEST_NOTICES if old[anchor] != data[anchor]}
+            for kind in moved & set(old['sent']):
+                self.sent_notifications.discard(SentNotices.key(c_id, kind))
+            data['sent'] = sorted((set(old['sent']) - moved) | set(data.get('sent', [])))
+        data.setdefault('sent', [])
+        self.pending_contests[c_id] = data
+        self.store.save_contest(c_id, data)
+        now_ts = self.clock.time()
+        for kind, anchor, offset, label in CONTEST_NOTICES:
+            if kind in data['sent']: continue
+            fire_ts = (data[anchor] + offset).timestamp()
+            # 予約した時点で猶予を過ぎているもの（開始10時間前に見つけた24h通知など）は積まない
+            if now_ts - fire_ts > NOTICE_GRACE_SEC: continue
+            self.notice_seq += 1
+            heapq.heappush(self.notice_heap, (fire_ts, self.notice_seq, c_id, kind))
+        # 次の締め切りが早まったかもしれないので通知タスクを起こす
+        self.notice_wakeup.set()
+
+    async def run_contest_notifier(self):
+        """次の通知時刻までちょうど眠り、時刻が来たものから送る（1分ごとの見回りはしない）"""
+        await self.wait_until_ready()
+        while not self.is_closed():
+            self.notice_wakeup.clear()
+            while self.notice_heap and self.notice_heap[0][0] <= self.clock.time():
+                fire_ts, _, c_id, kind = heapq.heappop(self.notice_heap)
+                try:
+                    await self.fire_contest_notice(c_id, kind, fire_ts)
+                except Exception as e:
+                    print(f"⚠️ コンテスト通知エラー ({c_id}/{kind}): {e}")
+            timeout = self.notice_heap[0][0] - self.clock.time() if self.notice_heap else None
+            try:
+                await asyncio.wait_for(self.notice_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def fire_contest_notice(self, c_id, kind, fire_ts):
+        data = self.pending_contests.get(c_id)
+        if not data or kind in data['sent']: return
+        _, anchor, offset, label = next(n for n in CONTEST_NOTICES if n[0] == kind)
+        # 予定が変わった後の古い要素なら捨てる（新しい時刻の要素が別に積まれている）
+        if abs((data[anchor] + offset).timestamp() - fire_ts) > 1: return
+        late = self.clock.time() - fire_ts
+        if late > NOTICE_GRACE_SEC:
+            print(f"⏭️ 通知見送り ({c_id}/{kind}): {late:.0f}秒遅れ")
+        else:
+            await self.broadcast_contest(data['name'], data['url'], data['start'], data['duration'], data['rated'],
+                                         label, data['details'], is_start=(kind == "start"), kind=kind)
+        data['sent'].append(kind)
+        if kind == "end":
+            # 終了したコンテストはリストから削除
+            del self.pending_contests[c_id]
+            self.store.delete_contest(c_id)
+        else:
+            self.store.save_contest(c_id, data)
 
 bot = AtCoderBot()
 
@@ -662,19 +2440,21 @@ bot = AtCoderBot()
 async def register(interaction: discord.Interaction, discord_user: discord.Member, atcoder_id: str, channel: discord.TextChannel, only_ac: bool):
     try: await interaction.response.defer(ephemeral=True)
     except: return
-    info = {"guild_id": interaction.guild_id, "discord_user_id": discord_user.id, "atcoder_id": atcoder_id, "channel_id": channel.id, "only_ac": only_ac, "last_sub_id": 0}
-    bot.user_data[f"{interaction.guild_id}_{atcoder_id}"] = info
-    bot.save_to_sheets()
+    info = bot.registry.add(Registration(interaction.guild_id, atcoder_id, discord_user.id, channel.id, only_ac))
+    bot.save_registration(info.key)
     await interaction.followup.send(f"✅ `{atcoder_id}` さんの登録が完了しました。", ephemeral=True)
-    async with aiohttp.ClientSession() as session: await bot.process_submissions(session, info, lookback_seconds=86400)
+    try:
+        await bot.process_submissions(bot.session, atcoder_id, [info], lookback_seconds=86400)
+    except UpstreamError as e:
+        # カーソル未保存のままなので、次の提出チェックで拾われる
+        print(f"⚠️ 登録直後の提出確認を見送り ({atcoder_id}): {e}")
 
 @bot.tree.command(name="delete", description="提出通知の削除")
 async def delete(interaction: discord.Interaction, atcoder_id: str):
     try: await interaction.response.defer()
     except: return
     key = f"{interaction.guild_id}_{atcoder_id}"
-    if key in bot.user_data:
-        del bot.user_data[key]; bot.save_to_sheets()
+    if bot.remove_registration(key):
         await interaction.followup.send(f"🗑️ `{atcoder_id}` さんの登録を削除しました。")
     else: await interaction.followup.send("未登録です。")
 
@@ -683,7 +2463,7 @@ async def notice_set(interaction: discord.Interaction, channel: discord.TextChan
     try: await interaction.response.defer()
     except: return
     bot.news_config[str(interaction.guild_id)] = channel.id
-    bot.save_to_sheets()
+    bot.store.set_news_channel(interaction.guild_id, channel.id)
     # 最初に「考え中」を消すための応答を返す
     await interaction.response.send_message(f"告知先を {channel.mention} に設定しました。", ephemeral=True)
     
@@ -696,7 +2476,7 @@ async def notice_delete(interaction: discord.Interaction):
     except: return
     gid = str(interaction.guild_id)
     if gid in bot.news_config:
-        del bot.news_config[gid]; bot.save_to_sheets()
+        del bot.news_config[gid]; bot.store.delete_news_channel(gid)
         await interaction.followup.send("🗑️ 告知登録を削除しました。")
     else: await interaction.followup.send("未設定。")
 
@@ -713,17 +2493,17 @@ async def status(interaction: discord.Interaction, member: discord.Member = None
     target = member or interaction.user
     
     # ここからデータ取得（時間のかかる処理）
-    atcoder_id = next((v['atcoder_id'] for v in bot.user_data.values() if v['discord_user_id'] == target.id), None)
+    # 索引から引く（このサーバーでの登録があればそれを優先）
+    regs = sorted(bot.registry.for_discord_user(target.id), key=lambda v: v.guild_id != interaction.guild_id)
+    atcoder_id = regs[0].atcoder_id if regs else None
     
     if not atcoder_id:
         return await interaction.followup.send(f"❌ {target.name} さんのIDが登録されていません。")
 
-    async with aiohttp.ClientSession() as session:
-        # AlgoとHeurを並列で取得して時短する（任意ですが推奨）
-        import asyncio
-        algo_task = bot.fetch_user_data(session, atcoder_id, mode='algo')
-        heur_task = bot.fetch_user_data(session, atcoder_id, mode='heur')
-        algo_d, heur_d = await asyncio.gather(algo_task, heur_task)
+    # AlgoとHeurを並列で取得して時短する（キャッシュにあれば取得しない）
+    algo_task = bot.status_cache.get((atcoder_id, 'algo'))
+    heur_task = bot.status_cache.get((atcoder_id, 'heur'))
+    algo_d, heur_d = await asyncio.gather(algo_task, heur_task)
 
     embeds = []
     if algo_d: embeds.append(bot.create_status_embed(algo_d, target))
@@ -742,7 +2522,7 @@ async def preview(interaction: discord.Interaction, type: str):
     dummy_url = "https://atcoder.jp/contests/practice"
     dummy_st = datetime.now(JST)
     if type == "ac":
-        await bot.send_ac_notification({'atcoder_id': 'atcoder', 'discord_user_id': interaction.user.id, 'channel_id': interaction.channel_id}, {'id': 0, 'problem_id': 'abc_a', 'contest_id': 'abc', 'result': 'AC', 'point': 100, 'language': 'Python', 'epoch_second': int(datetime.now().timestamp())})
+        await bot.send_ac_notification(Registration(interaction.guild_id or 0, 'atcoder', interaction.user.id, interaction.channel_id), {'id': 0, 'problem_id': 'abc_a', 'contest_id': 'abc', 'result': 'AC', 'point': 100, 'language': 'Python', 'epoch_second': int(datetime.now().timestamp())})
     else:
         # 時間を "01:40" (文字列) から 100 (数値) に変更
         # かつ、不要な引数 (is_10min等) を削除
@@ -766,56 +2546,47 @@ async def recent_contests(interaction: discord.Interaction):
     now = datetime.now(JST)
     one_week_ago = now - timedelta(days=7)
     
-    async with aiohttp.ClientSession() as session:
-        # コンテスト一覧ページを取得
-        async with session.get("https://atcoder.jp/contests/archive?lang=ja") as resp:
-            if resp.status != 200:
-                return await interaction.followup.send("コンテスト情報の取得に失敗しました。")
-            soup = BeautifulSoup(await resp.text(), 'html.parser')
-
-        table = soup.find('table')
-        if not table:
-            return await interaction.followup.send("コンテストテーブルが見つかりませんでした。")
-
-        rows = table.find_all('tr')[1:] # ヘッダー除外
-        found_contests = []
-
-        for row in rows:
-            cols = row.find_all('td')
-            if len(cols) < 4: continue
+    session = bot.session
+    # コンテスト一覧ページを取得
+    try:
+        status, page, _ = await bot.http_get("https://atcoder.jp/contests/archive?lang=ja", "page", session=session)
+    except UpstreamError:
+        status = None
+    if status != 200:
+        return await interaction.followup.send("コンテスト情報の取得に失敗しました。")
+
+    table = await bot.parse(parse_contest_table, page)
+    if not table:
+        return await interaction.followup.send("コンテストテーブルが見つかりませんでした。")
+
+    found_contests = []
+
+    for row in table["rows"]: # ヘッダー除外済み
+        if row["duration"] is None or row["rated"] is None: continue
             
-            # 開始時刻
-            time_tag = cols[0].find('time')
-            if not time_tag: continue
-            st_dt = datetime.strptime(time_tag.text.strip(), '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
+        # 開始時刻
+        st_dt = datetime.strptime(row["time"], '%Y-%m-%d %H:%M:%S%z').astimezone(JST)
             
-            # 過去1週間以内か判定
-            if one_week_ago <= st_dt <= now:
-                a_tag = cols[1].find('a')
-                c_id = a_tag['href'].split('/')[-1]
-                c_name = a_tag.text.strip()
-                duration = cols[2].text.strip()
-                rated = cols[3].text.strip()
-                c_url = f"https://atcoder.jp/contests/{c_id}"
-                
-                # 詳細(Writer/Tester等)を取得
-                details = await bot.fetch_post_details(session, c_id)
-                found_contests.append({
-                    "name": c_name, "url": c_url, "st": st_dt, 
-                    "dur": duration, "rated": rated, "details": details
-                })
-
-        if not found_contests:
-            return await interaction.followup.send("過去1週間以内に開催されたコンテストはありません。")
-
-        # 1つずつEmbedを送信
-        for c in found_contests:
-            # 既存の create_contest_embed を利用
-            # 引数の型を調整 (dur を数値にする必要がある場合は parse_duration を通す)
-            embed = bot.create_contest_embed(
-                c['name'], c['url'], c['st'], c['dur'], c['rated'], c['details']
-            )
-            await interaction.followup.send(embed=embed)
+        # 過去1週間以内か判定
+        if one_week_ago <= st_dt <= now:
+            c_id = row["href"].split('/')[-1]
+            c_url = f"https://atcoder.jp/contests/{c_id}"
+            found_contests.append({
+                "id": c_id, "name": row["name"], "url": c_url, "st": st_dt, 
+                "dur": row["duration"], "rated": row["rated"]
+            })
+
+    if not found_contests:
+        return await interaction.followup.send("過去1週間以内に開催されたコンテストはありません。")
+
+    # 詳細(Writer/Tester等)はキャッシュを使い、無いものだけ並列で取得
+    details = await bot.get_post_details_many([c['id'] for c in found_contests])
+
+    # 既存の create_contest_embed を利用して、10個ずつまとめて送信
+    embeds = [bot.create_contest_embed(c['name'], c['url'], c['st'], c['dur'], c['rated'], details[c['id']])
+              for c in found_contests]
+    for i in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE):
+        await interaction.followup.send(embeds=embeds[i:i + MAX_EMBEDS_PER_MESSAGE])
 
 if __name__ == "__main__":
-    keep_alive(); bot.run(os.getenv("DISCORD_TOKEN"))
+    bot.run(os.getenv("DISCORD_TOKEN"))